@@ -2,19 +2,39 @@ import os
 import django
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-import button_printer.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ongeki_helper_Web.settings')
 
 # 初始化 Django
 django.setup()
 
+import button_printer.routing
+from button_printer.consumers import start_background_services, stop_background_services
+
 # 获取 Django 的 ASGI 应用
 django_asgi_app = get_asgi_application()
 
+
+async def lifespan_app(scope, receive, send):
+    """
+    ASGI lifespan：启动时启动进程内读取器和本地数据报入口，关闭时停止
+    Daphne 不发送 lifespan 事件，此时由 HIDConsumer 在页面连接时启动
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            start_background_services()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await stop_background_services()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": URLRouter(
         button_printer.routing.websocket_urlpatterns
     ),
-})
\ No newline at end of file
+    "lifespan": lifespan_app,
+})
@@ -131,4 +131,27 @@ CHANNEL_LAYERS = {
         # 'BACKEND': 'channels_redis.core.RedisChannelLayer',
         # 'CONFIG': {'hosts': [('127.0.0.1', 6379)]},
     },
-}
\ No newline at end of file
+}
+
+# HID 广播后端
+# 'channel_layer': 通过上面的 CHANNEL_LAYERS 广播（默认，多进程部署）
+# 'local': 单进程 Daphne 时直接广播给本进程内的连接，不经过 channel layer
+HID_FANOUT_BACKEND = 'channel_layer'
+
+# 每个 WebSocket 连接的发送队列长度，队列满时显示更新合并为最新状态
+HID_CLIENT_QUEUE_SIZE = 64
+
+# 进程内 HID 读取器
+# True: 服务器进程内直接读取 button_printer/config.ini 中的设备，不需要再运行 hid_reader.py
+#       （HID 设备固定使用 thread 模式读取；Daphne 下第一个页面连接时启动）
+# False: 由单独运行的 hid_reader.py 通过 WebSocket 发送数据（默认）
+HID_INPROCESS_READER = False
+
+# 本地数据报入口：同一台机器上的 hid_reader 可以把 bin1 帧直接发到这里（config.ini [reader] transport = datagram）
+# 'udp:127.0.0.1:8765'，Linux 上也可以用 'unix:/tmp/ongeki-hid.sock'；空字符串表示不打开（默认）
+HID_DATAGRAM_ENDPOINT = ''
+# 入口收到的内容，与 hid_reader 的 config.ini [reader] transport 相同
+# 'datagram': 每个数据报是 hid_reader 的 generation + 一个 bin1 帧（默认）
+# 'shared_memory': hid_reader 把最新状态写入名为 HID_SHARED_STATE_NAME 的共享内存，数据报只用于唤醒
+HID_LOCAL_TRANSPORT = 'datagram'
+HID_SHARED_STATE_NAME = 'ongeki_hid_state'
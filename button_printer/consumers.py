@@ -1,10 +1,166 @@
 # button_printer/consumers.py
 import json
-import asyncio
 import time
 
 from channels.generic.websocket import AsyncWebsocketConsumer
-from .services import HIDService
+from django.conf import settings
+from .fanout import get_fanout
+from .hid_protocol import (
+    DISPLAY_WIRE_NAME, WIRE_NAME, decode_display_frame, decode_frame, encode_display_frame, slot_device_id,
+)
+from .datagram import endpoint_status, ensure_endpoint_started, stop_endpoint
+from .inprocess import ensure_reader_started, reader_status, stop_reader
+from .outbox import ClientOutbox
+from .services import HIDE, IMAGE_IDS, IMAGE_KEYS, SHOW, HIDService, transitions
+
+# 广播组：页面只接收显示更新，hid_reader 不会收到自己引起的广播
+VIEWER_GROUP = "web_clients"
+READER_GROUP = "hid_readers"
+
+
+# 已断开（hid_reader 报告 device_status = lost）的设备，新连接的页面也会收到断开状态
+lost_devices = set()
+
+
+def device_viewer_group(device_id):
+    """只显示一个设备的页面（/ws/hid/<device_id>/）所在的广播组"""
+    return f"{VIEWER_GROUP}.{device_id}"
+
+
+def build_device_status(device_id, connected):
+    """设备断开 / 重新连接的消息，页面据此显示设备断开"""
+    return {
+        'type': 'device_status',
+        'device_id': device_id,
+        'connected': connected,
+        'timestamp': time.time()
+    }
+
+
+def build_display_update(events):
+    """批量显示更新消息"""
+    return {
+        'type': 'batch_display_update',
+        'events': events,
+        'total_events': len(events),
+        'timestamp': time.time(),
+        'high_priority': True
+    }
+
+
+def encode_display_update(events):
+    """编码批量显示更新，发送队列合并更新时也使用"""
+    return {'text': json.dumps(build_display_update(events))}
+
+
+class DisplayFrame:
+    """
+    一次显示更新的编码结果
+    每种格式（JSON / ids1 二进制）在第一个需要它的连接发送时才编码，之后所有连接共用
+    """
+    __slots__ = ('events', 'text', 'bytes')
+
+    def __init__(self, events):
+        self.events = events
+        self.text = None
+        self.bytes = None
+
+    def message(self, wire):
+        """按连接的格式返回可发送的 message"""
+        if wire == DISPLAY_WIRE_NAME:
+            if self.bytes is None:
+                self.bytes = {'bytes': encode_display_frame(self.events, IMAGE_IDS)}
+            return self.bytes
+        if self.text is None:
+            self.text = encode_display_update(self.events)
+        return self.text
+
+
+def display_events_from_frame(frame):
+    """从 ids1 帧还原显示事件（channel layer 广播只带编码好的结果）"""
+    return [(SHOW if visible else HIDE)[IMAGE_KEYS[image_id]] for image_id, visible in decode_display_frame(frame)]
+
+
+async def broadcast_display(display_events, device_id=None):
+    """
+    立即广播，不等待结果
+    每种格式只编码一次，每个客户端直接发送编码好的结果
+    device_id 不为 None 时同时发给只显示该设备的页面
+    """
+    try:
+        message = {
+            'type': 'hid_broadcast',
+            'frame': DisplayFrame(display_events),
+        }
+        fanout = get_fanout()
+        await fanout.broadcast(VIEWER_GROUP, message)
+        if device_id is not None:
+            await fanout.broadcast(device_viewer_group(device_id), message)
+    except Exception as e:
+        print(f"❌ 广播失败: {e}")
+
+
+async def broadcast_device_status(device_id, connected):
+    """广播设备断开 / 重新连接"""
+    if connected:
+        lost_devices.discard(device_id)
+    else:
+        lost_devices.add(device_id)
+    print(f"{'🔌 设备已重新连接' if connected else '⚠️ 设备已断开'}: {device_id}")
+    try:
+        message = {'type': 'hid_action', 'action': build_device_status(device_id, connected)}
+        fanout = get_fanout()
+        await fanout.broadcast(VIEWER_GROUP, message)
+        await fanout.broadcast(device_viewer_group(device_id), message)
+    except Exception as e:
+        print(f"❌ 广播失败: {e}")
+
+
+async def ingest_hid_data(device_id, hid_data):
+    """
+    一条 HID 数据：解析 -> 与当前显示比较 -> 广播给页面
+    HIDConsumer（hid_reader 通过 WebSocket 发送）和进程内读取器共用
+    device_status 数据只广播设备状态；断开的设备又收到数据时视为已重新连接
+
+    返回:
+        实际广播的显示事件列表
+    """
+    status = hid_data.get('device_status')
+    if status is not None:
+        await broadcast_device_status(device_id, status == 'connected')
+        return []
+    if device_id in lost_devices:
+        await broadcast_device_status(device_id, True)
+
+    session = HIDService.get_session(device_id)
+    display_events = HIDService.process_structured_hid_data(hid_data, session)
+
+    # 只广播显示状态实际变化的图片
+    display_events = HIDService.diff_display_events(device_id, display_events)
+    if display_events:
+        # 广播只放入各连接的发送队列，不会被慢的页面阻塞
+        await broadcast_display(display_events, device_id)
+    return display_events
+
+
+def start_background_services():
+    """
+    按 settings 启动进程内读取器和本地数据报入口（可以重复调用）
+    asgi.py 的 lifespan 启动时调用；Daphne 不发送 lifespan 事件，页面连接时也会调用
+    """
+    if getattr(settings, 'HID_INPROCESS_READER', False):
+        ensure_reader_started()
+    endpoint = getattr(settings, 'HID_DATAGRAM_ENDPOINT', '')
+    if endpoint:
+        ensure_endpoint_started(
+            endpoint,
+            getattr(settings, 'HID_LOCAL_TRANSPORT', 'datagram'),
+            getattr(settings, 'HID_SHARED_STATE_NAME', 'ongeki_hid_state'))
+
+
+async def stop_background_services():
+    await stop_reader()
+    await stop_endpoint()
 
 
 class HIDConsumer(AsyncWebsocketConsumer):
@@ -12,7 +168,12 @@ class HIDConsumer(AsyncWebsocketConsumer):
         super().__init__(*args, **kwargs)
         self.client_type = None
         self.device_id = None
+        self.device_ids = []  # hid_reader 各槽位的设备 id
         self.connected_time = None
+        self.wire = 'json'
+        self.send_ack = True  # 每条 HID 数据是否回复 processing_result
+        self.group = None
+        self.outbox = None
 
     async def connect(self):
         """WebSocket连接建立"""
@@ -20,6 +181,12 @@ class HIDConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
 
+        # 每个连接自己的发送队列和发送任务
+        self.outbox = ClientOutbox(
+            self.send_encoded, self.encode_display, self.decode_display,
+            maxsize=getattr(settings, 'HID_CLIENT_QUEUE_SIZE', 64))
+        self.outbox.start()
+
         # 立即发送性能模式确认
         await self.send_immediately({
             'type': 'performance_mode',
@@ -31,12 +198,27 @@ class HIDConsumer(AsyncWebsocketConsumer):
         query_string = self.scope.get('query_string', b'').decode()
         if 'client_type=hid_reader' in query_string:
             self.client_type = 'hid_reader'
-            self.device_id = self.get_device_id_from_query(query_string)
+            # 多设备时按槽位顺序带多个 device_id
+            self.device_ids = self.get_device_ids_from_query(query_string)
+            self.device_id = self.device_ids[0]
+            # 二进制帧协商
+            if f'wire={WIRE_NAME}' in query_string:
+                self.wire = WIRE_NAME
+            # ack=0: 不回复 processing_result
+            if 'ack=0' in query_string:
+                self.send_ack = False
+            self.group = READER_GROUP
         else:
             self.client_type = 'web_client'
+            # 页面使用 image id 的二进制显示更新
+            if f'wire={DISPLAY_WIRE_NAME}' in query_string:
+                self.wire = DISPLAY_WIRE_NAME
+            # /ws/hid/<device_id>/ 只接收该设备的显示更新
+            self.device_id = self.scope.get('url_route', {}).get('kwargs', {}).get('device_id')
+            self.group = VIEWER_GROUP if self.device_id is None else device_viewer_group(self.device_id)
 
         # 加入广播组
-        await self.channel_layer.group_add("web_clients", self.channel_name)
+        await get_fanout().subscribe(self, self.group)
 
         # 快速发送连接确认
         await self.send_immediately({
@@ -44,26 +226,57 @@ class HIDConsumer(AsyncWebsocketConsumer):
             'client_type': self.client_type,
             'message': '连接已建立',
             'high_performance': True,
+            'wire': self.wire,
+            'ack': self.send_ack,
             'timestamp': self.connected_time
         })
 
+        # 进程内读取器/数据报入口：Daphne 不发送 lifespan 事件，第一个页面连接时启动
+        if self.client_type == 'web_client':
+            start_background_services()
+
+        # 新页面立即恢复当前画面，不用等下一次输入
+        if self.client_type == 'web_client':
+            for device_id in sorted(lost_devices):
+                if self.device_id is None or self.device_id == device_id:
+                    await self.send_immediately(build_device_status(device_id, False))
+            visible_keys = HIDService.display_snapshot(self.device_id)
+            if visible_keys is not None:
+                await self.send_immediately({
+                    'type': 'display_snapshot',
+                    'visible': visible_keys,
+                    'timestamp': time.time()
+                })
+
         print(f"✅ {self.client_type} 连接: {self.channel_name}")
 
-    def get_device_id_from_query(self, query_string):
-        """快速提取设备ID"""
+    def get_device_ids_from_query(self, query_string):
+        """快速提取设备ID（可以有多个）"""
         import urllib.parse
         params = urllib.parse.parse_qs(query_string)
-        return params.get('device_id', ['unknown'])[0]
+        return params.get('device_id', ['unknown'])
 
     async def disconnect(self, close_code):
         """快速断开处理"""
+        if self.group:
+            await get_fanout().unsubscribe(self, self.group)
+        if self.outbox:
+            await self.outbox.stop()
+            if self.outbox.dropped or self.outbox.collapsed:
+                print(f"⚠️ {self.client_type} 发送跟不上: 合并 {self.outbox.collapsed} 丢弃 {self.outbox.dropped}")
         print(f"🔌 {self.client_type} 断开: {close_code}")
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """
         高性能消息处理 - 最小化延迟
         """
         try:
+            # 二进制帧只用于 HID 数据
+            if bytes_data is not None:
+                if self.client_type == 'hid_reader':
+                    await self.process_hid_frame(bytes_data)
+                return
+
             data = json.loads(text_data)
             message_type = data.get('type')
 
@@ -99,6 +312,38 @@ class HIDConsumer(AsyncWebsocketConsumer):
         # 立即发送，不等待任何处理
         await self.send_immediately(action_data)
 
+    async def hid_broadcast(self, event):
+        """
+        已编码的广播消息 - 所有客户端共用同一份编码结果
+        放入发送队列，不等待 socket
+        """
+        frame = event.get('frame')
+        if frame is not None:
+            # 进程内广播：按本连接的格式取共用的编码结果
+            self.outbox.put(frame.message(self.wire), frame.events)
+            return
+        # channel layer：放入 ids1 帧，发送队列满时才还原为事件列表合并
+        if self.wire == DISPLAY_WIRE_NAME:
+            message = {'bytes': event['bytes']}
+        else:
+            message = {'text': event['text']}
+        self.outbox.put(message, event['bytes'])
+
+    def encode_display(self, events):
+        """按本连接的格式编码显示更新（发送队列合并更新时使用）"""
+        return DisplayFrame(events).message(self.wire)
+
+    def decode_display(self, frame):
+        """ids1 帧还原为事件列表（发送队列合并更新时使用）"""
+        return display_events_from_frame(frame)
+
+    async def send_encoded(self, message):
+        """发送已编码的消息（发送队列的发送任务调用）"""
+        if 'bytes' in message:
+            await self.send(bytes_data=message['bytes'])
+        else:
+            await self.send(text_data=message['text'])
+
     async def process_hid_reader_message(self, data):
         """
         优化版 HID 读取器消息处理
@@ -116,32 +361,31 @@ class HIDConsumer(AsyncWebsocketConsumer):
                 'timestamp': time.time()
             })
 
+    async def process_hid_frame(self, frame):
+        """
+        二进制 HID 帧处理
+        """
+        device_slot, seq, hid_data = decode_frame(frame)
+        if device_slot < len(self.device_ids):
+            device_id = self.device_ids[device_slot]
+        else:
+            device_id = slot_device_id(hid_data['DEVICE_NAME'], device_slot)
+        await self.process_hid_data_optimized({'device_id': device_id, 'data': hid_data})
+
     async def process_hid_data_optimized(self, data):
         """
         高性能 HID 数据处理 - 直接转发，最小化处理
         """
         try:
-            hid_data = data.get('data', {})
-
-            # 快速处理 HID 数据
-            display_events = HIDService.process_structured_hid_data(hid_data)
-
+            # 多设备的 hid_reader 在每条数据中带上设备 id
+            device_id = data.get('device_id') or self.device_id
+            display_events = await ingest_hid_data(device_id, data.get('data', {}))
             if not display_events:
                 return
 
-            # 立即构建批量更新消息
-            batch_event = {
-                'type': 'batch_display_update',
-                'events': display_events,
-                'total_events': len(display_events),
-                'timestamp': time.time(),
-                'high_priority': True
-            }
-
-            # 直接广播，不等待
-            asyncio.create_task(self.broadcast_immediately(batch_event))
-
             # 快速响应给 HID 读取器
+            if not self.send_ack:
+                return
             await self.send_immediately({
                 'type': 'processing_result',
                 'display_events_count': len(display_events),
@@ -156,29 +400,11 @@ class HIDConsumer(AsyncWebsocketConsumer):
                 'timestamp': time.time()
             })
 
-    async def broadcast_immediately(self, event_data):
-        """
-        立即广播，不等待结果
-        """
-        try:
-            await self.channel_layer.group_send(
-                "web_clients",
-                {
-                    'type': 'hid_action',
-                    'action': event_data
-                }
-            )
-        except Exception as e:
-            print(f"❌ 广播失败: {e}")
-
     async def send_immediately(self, data):
         """
         立即发送消息，不进行复杂处理
         """
-        try:
-            await self.send(text_data=json.dumps(data))
-        except Exception as e:
-            print(f"❌ 发送失败: {e}")
+        self.outbox.put({'text': json.dumps(data)})
 
     async def process_web_client_message(self, data):
         """
@@ -195,5 +421,10 @@ class HIDConsumer(AsyncWebsocketConsumer):
             await self.send_immediately({
                 'type': 'system_status',
                 'hid_connected': True,
+                'outbox': self.outbox.stats(),
+                'transitions': transitions.stats(),
+                'inprocess_reader': reader_status(),
+                'datagram_endpoint': endpoint_status(),
+                'lost_devices': sorted(lost_devices),
                 'timestamp': time.time()
             })
\ No newline at end of file
@@ -0,0 +1,266 @@
+# button_printer/datagram.py
+"""
+本地数据报入口（settings.HID_DATAGRAM_ENDPOINT）
+
+settings.HID_LOCAL_TRANSPORT 选择入口收到的内容:
+    datagram: hid_reader 把 generation + bin1 帧作为 UDP / Unix 数据报发送到这里，
+              数据报按到达顺序由一个任务依次处理，同一个 hid_reader 进程中过期（seq 更小）的帧直接丢弃
+    shared_memory: hid_reader 把最新状态写入共享内存（hid_protocol.StateSegment），
+              这里只收到门铃，被唤醒后读取各槽位的最新帧，积压的门铃合并为一次读取
+解码后交给 consumers.ingest_hid_data，与 WebSocket 发送的数据走同样的处理和广播。
+"""
+import asyncio
+import os
+import socket
+
+from .hid_protocol import DATAGRAM, DOORBELL, FRAME, FrameError, StateSegment, decode_frame, parse_endpoint, slot_device_id
+
+# 处理跟不上时最多积压的帧数，超过后丢弃新到的帧
+QUEUE_SIZE = 256
+
+
+class DatagramIngestProtocol(asyncio.DatagramProtocol):
+    """接收数据报放入队列，由 run() 依次处理"""
+
+    def __init__(self, ingest):
+        self.ingest = ingest
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.transport = None
+        self.task = None
+        self.last_seq = {}  # (地址, 槽位) -> (generation, 上一个处理的 seq)，只保留最新的 generation
+
+        # 统计
+        self.received = 0
+        self.bad_frames = 0
+        self.stale_frames = 0
+        self.dropped = 0  # 队列满时丢弃的最早的帧数
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.task = asyncio.create_task(self.run())
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        if len(data) != DATAGRAM.size + FRAME.size:
+            self.bad_frames += 1
+            return
+        try:
+            self.queue.put_nowait((data, addr))
+        except asyncio.QueueFull:
+            # 最新状态优先：丢弃最早的帧，否则丢掉的释放之后没有新帧时按键会一直显示按下
+            self.queue.get_nowait()
+            self.queue.put_nowait((data, addr))
+            self.dropped += 1
+
+    def error_received(self, exc):
+        print(f"❌ 数据报入口错误: {exc}")
+
+    async def run(self):
+        while True:
+            data, addr = await self.queue.get()
+            (generation,) = DATAGRAM.unpack_from(data)
+            try:
+                device_slot, seq, hid_data = decode_frame(data[DATAGRAM.size:])
+            except FrameError:
+                self.bad_frames += 1
+                continue
+            source = (addr, device_slot)
+            last = self.last_seq.get(source)
+            # hid_reader 重新启动后 generation 改变，seq 重新从 1 开始，旧 generation 的记录直接替换
+            # seq 回绕时差值按 uint32 计算
+            if last is not None and last[0] == generation and (seq - last[1]) & 0xFFFFFFFF >= 0x80000000:
+                self.stale_frames += 1
+                continue
+            self.last_seq[source] = (generation, seq)
+            try:
+                await self.ingest(slot_device_id(hid_data['DEVICE_NAME'], device_slot), hid_data)
+            except Exception as e:
+                print(f"❌ 数据报处理错误: {e}")
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'bad_frames': self.bad_frames,
+            'stale_frames': self.stale_frames,
+            'dropped': self.dropped,
+        }
+
+
+class SharedStateProtocol(asyncio.DatagramProtocol):
+    """
+    接收门铃，由 run() 读取共享内存中被唤醒槽位的最新帧
+    处理期间到达的门铃只会让 run() 再读一次，中间的状态不会逐个处理
+    """
+
+    def __init__(self, ingest, segment_name):
+        self.ingest = ingest
+        self.segment_name = segment_name
+        self.segment = None
+        self.generation = None  # 门铃中最新的 generation
+        self.ready_slots = set()
+        self.wakeup = asyncio.Event()
+        self.transport = None
+        self.task = None
+        self.last_seq = {}  # 槽位 -> 上一个处理的 seq
+
+        # 统计
+        self.received = 0
+        self.bad_frames = 0
+        self.stale_frames = 0
+        self.collapsed = 0  # 没有单独处理的门铃数
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.task = asyncio.create_task(self.run())
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        if len(data) != DOORBELL.size:
+            self.bad_frames += 1
+            return
+        self.generation, slot = DOORBELL.unpack(data)
+        if slot in self.ready_slots:
+            self.collapsed += 1
+        self.ready_slots.add(slot)
+        self.wakeup.set()
+
+    def error_received(self, exc):
+        print(f"❌ 数据报入口错误: {exc}")
+
+    def attach_segment(self):
+        """hid_reader 重新启动后 generation 改变，重新打开共享内存"""
+        if self.segment is not None and self.segment.generation == self.generation:
+            return True
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+            self.last_seq.clear()
+        try:
+            self.segment = StateSegment.attach(self.segment_name)
+        except (FileNotFoundError, FrameError) as e:
+            print(f"❌ 共享内存打开失败: {e}")
+            return False
+        print(f"🧠 共享内存已打开: {self.segment_name} ({self.segment.slot_count} 个槽位)")
+        return True
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            slots = self.ready_slots
+            self.ready_slots = set()
+            if not self.attach_segment():
+                continue
+            for slot in slots:
+                try:
+                    frame = self.segment.read(slot)
+                    if frame is None:
+                        continue
+                    device_slot, seq, hid_data = decode_frame(frame)
+                except FrameError:
+                    self.bad_frames += 1
+                    continue
+                if self.last_seq.get(slot) == seq:
+                    # 上一次唤醒已经读到了这个状态
+                    self.stale_frames += 1
+                    continue
+                self.last_seq[slot] = seq
+                try:
+                    await self.ingest(slot_device_id(hid_data['DEVICE_NAME'], device_slot), hid_data)
+                except Exception as e:
+                    print(f"❌ 共享内存数据处理错误: {e}")
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'bad_frames': self.bad_frames,
+            'stale_frames': self.stale_frames,
+            'collapsed': self.collapsed,
+        }
+
+
+LOCAL_TRANSPORTS = ('datagram', 'shared_memory')
+
+_transport = None
+_protocol = None
+_starting = False
+
+
+def ensure_endpoint_started(endpoint, transport='datagram', segment_name=None):
+    """
+    入口没有打开时在当前事件循环中打开（可以重复调用）
+
+    参数:
+        endpoint: 入口地址（hid_protocol.parse_endpoint）
+        transport: datagram / shared_memory
+        segment_name: shared_memory 时共享内存的名字
+    """
+    global _starting
+    if _transport is not None or _starting:
+        return
+    if transport not in LOCAL_TRANSPORTS:
+        print(f"❌ 未知的 HID_LOCAL_TRANSPORT: {transport}")
+        return
+    _starting = True
+    asyncio.get_running_loop().create_task(_start_endpoint(endpoint, transport, segment_name))
+
+
+async def _start_endpoint(endpoint, transport_name, segment_name):
+    global _transport, _protocol, _starting
+    from .consumers import ingest_hid_data
+
+    def protocol_factory():
+        if transport_name == 'shared_memory':
+            return SharedStateProtocol(ingest_hid_data, segment_name)
+        return DatagramIngestProtocol(ingest_hid_data)
+
+    try:
+        family, address = parse_endpoint(endpoint)
+        if family == socket.AF_INET:
+            transport, protocol = await asyncio.get_running_loop().create_datagram_endpoint(
+                protocol_factory, local_addr=address)
+        else:
+            # 上次没有正常退出时留下的 socket 文件
+            if os.path.exists(address):
+                os.unlink(address)
+            transport, protocol = await asyncio.get_running_loop().create_datagram_endpoint(
+                protocol_factory, local_addr=address, family=family)
+        _transport, _protocol = transport, protocol
+        print(f"📮 数据报入口已打开: {endpoint} ({transport_name})")
+    except (OSError, ValueError) as e:
+        print(f"❌ 数据报入口打开失败: {e}")
+    finally:
+        _starting = False
+
+
+async def stop_endpoint():
+    """关闭入口"""
+    global _transport, _protocol
+    if _transport is None:
+        return
+    _transport.close()
+    if _protocol.task:
+        _protocol.task.cancel()
+        try:
+            await _protocol.task
+        except asyncio.CancelledError:
+            pass
+    if isinstance(_protocol, SharedStateProtocol):
+        _protocol.close()
+    address = _transport.get_extra_info('sockname')
+    if isinstance(address, str) and address and os.path.exists(address):
+        os.unlink(address)
+    _transport = None
+    _protocol = None
+
+
+def endpoint_status():
+    """系统状态中显示的入口信息"""
+    if _protocol is None:
+        return {'running': False}
+    return dict(_protocol.stats(), running=True)
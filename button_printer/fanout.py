@@ -0,0 +1,82 @@
+# button_printer/fanout.py
+"""
+广播后端，在 settings.HID_FANOUT_BACKEND 中选择
+
+channel_layer: 通过 channels 的 group_send 广播（默认，多进程部署时使用）
+local: 进程内注册表，直接调用同一进程中订阅的 HIDConsumer（单进程 Daphne）
+"""
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .hid_protocol import DISPLAY_WIRE_NAME
+
+
+class ChannelLayerFanout:
+    """通过 channel layer 的 group 广播"""
+
+    async def subscribe(self, consumer, group):
+        await consumer.channel_layer.group_add(group, consumer.channel_name)
+
+    async def unsubscribe(self, consumer, group):
+        await consumer.channel_layer.group_discard(group, consumer.channel_name)
+
+    async def broadcast(self, group, message):
+        # channel layer 只能传递可序列化的数据，显示更新的两种格式都先编码好，
+        # 不带事件列表（InMemoryChannelLayer 会为每个连接复制一份），连接需要时从 ids1 帧还原
+        frame = message.get('frame')
+        if frame is not None:
+            message = {key: value for key, value in message.items() if key != 'frame'}
+            message.update(frame.message('json'))
+            message.update(frame.message(DISPLAY_WIRE_NAME))
+        await get_channel_layer().group_send(group, message)
+
+
+class LocalFanout:
+    """
+    进程内订阅注册表
+    不经过 InMemoryChannelLayer 的队列，直接调用 consumer 中与 message['type'] 同名的处理函数
+    """
+
+    def __init__(self):
+        self.groups = {}  # group -> {consumer: None}，保持订阅顺序
+
+    async def subscribe(self, consumer, group):
+        self.groups.setdefault(group, {})[consumer] = None
+
+    async def unsubscribe(self, consumer, group):
+        subscribers = self.groups.get(group)
+        if subscribers is not None:
+            subscribers.pop(consumer, None)
+            if not subscribers:
+                del self.groups[group]
+
+    async def broadcast(self, group, message):
+        subscribers = self.groups.get(group)
+        if not subscribers:
+            return
+        handler_name = message['type'].replace('.', '_')
+        for consumer in list(subscribers):
+            # 一个连接出错（例如正在关闭）不影响其它连接，与 channel layer 相同
+            try:
+                await getattr(consumer, handler_name)(message)
+            except Exception as e:
+                print(f"❌ 广播给 {getattr(consumer, 'client_type', None)} 失败: {e}")
+
+
+FANOUT_BACKENDS = {
+    'channel_layer': ChannelLayerFanout,
+    'local': LocalFanout,
+}
+
+_fanout = None
+
+
+def get_fanout():
+    """当前进程使用的广播后端（第一次调用时按 settings 创建）"""
+    global _fanout
+    if _fanout is None:
+        backend = getattr(settings, 'HID_FANOUT_BACKEND', 'channel_layer')
+        if backend not in FANOUT_BACKENDS:
+            raise ValueError(f'未知的 HID_FANOUT_BACKEND: {backend}')
+        _fanout = FANOUT_BACKENDS[backend]()
+    return _fanout
@@ -0,0 +1,323 @@
+# button_printer/hid_protocol.py
+"""
+hid_reader 与 HIDConsumer 之间的二进制帧格式
+
+不依赖 Django，hid_reader 打包时可以直接使用。
+连接时 hid_reader 在查询参数中带上 wire=bin1，服务器在 connection_established
+中回复相同的 wire 后才发送二进制帧，否则继续使用 JSON。
+
+帧格式（小端，共 17 字节）:
+    帧头  magic(B) version(B) device_kind(B) device_slot(B) seq(I)
+    数据  buttons(I) lever(h) sub_pos(h) flags(B)
+
+buttons:
+    io4/simgeki        switches[0] | switches[1] << 16
+    ontroller/nageki   key 字符串第 i 位为 '1' 时置位 bit i
+    yuangeki           键盘按下掩码，bit i 对应 services.BUTTON_KEYS[i]
+flags:
+    io4/simgeki        system_status
+    ontroller          idk
+
+设备状态帧（device_kind = STATUS_KIND）:
+    设备断开 / 重新连接时发送，buttons 为设备本身的 device_kind，flags 为 1 已连接 / 0 断开。
+    解码后的数据为 {'DEVICE_NAME': ..., 'device_status': 'connected' / 'lost'}，JSON 中也使用同样的字段。
+
+本地数据报入口（settings.HID_DATAGRAM_ENDPOINT / config.ini [reader] endpoint）:
+    同一台机器上 hid_reader 可以不经过 WebSocket，每个 bin1 帧作为一个 UDP / Unix 数据报发送，
+    没有握手、掩码和 TCP 的确认延迟。不需要协商，也没有回复。
+    每个数据报为 DATAGRAM(generation) + bin1 帧。generation 在 hid_reader 每次启动时重新生成，
+    服务器只在同一个 generation 内按 seq 判断帧是否过期，重新启动后 seq 从 1 开始的帧不会被当作过期帧丢弃
+    （Unix 数据报的发送方没有地址，多个 hid_reader 也能区分）。
+
+共享内存状态（transport = shared_memory）:
+    hid_reader 把每个槽位的最新 bin1 帧写入共享内存，再向数据报入口发送一个门铃
+    DOORBELL(generation, slot)。服务器被唤醒后只读取最新状态，连续的多个报告合并为一个。
+    段布局（小端）:
+        头    magic(4s) generation(I) slot_count(I)
+        槽位  seqlock(I) + bin1 帧，slot_count 个
+    seqlock 为奇数时正在写入，读取前后 seqlock 相同且为偶数时数据完整。
+    generation 与数据报相同，在 hid_reader 每次启动时重新生成，服务器据此重新打开共享内存。
+
+服务器发给页面的显示更新:
+    页面连接时带上 wire=ids1，显示更新以二进制发送，每个事件 2 字节 image_id(B) visible(B)，
+    image_id 为 services.IMAGE_KEYS 中的下标（页面通过 IMAGE_MANIFEST 得到同样的对应关系）。
+    不带 wire 参数的页面继续收到 JSON。
+    channel layer 广播中只带编码好的 JSON 和 ids1，需要事件列表时由连接从 ids1 帧解码。
+"""
+import os
+import socket
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+WIRE_VERSION = 1
+WIRE_NAME = 'bin1'
+FRAME_MAGIC = 0x4F  # 'O'
+FRAME = struct.Struct('<BBBBIIhhB')
+
+DEVICE_KINDS = {
+    'io4': 1,
+    'simgeki': 2,
+    'ontroller': 3,
+    'nageki': 4,
+    'yuangeki': 5,
+}
+DEVICE_NAMES = {kind: name for name, kind in DEVICE_KINDS.items()}
+STATUS_KIND = 0
+DEVICE_STATUS = ('lost', 'connected')
+
+DISPLAY_WIRE_NAME = 'ids1'
+# image_id 为 1 字节，最多 256 张图片
+DISPLAY_MAX_IMAGES = 256
+
+# nageki 有 10 个按钮，ontroller 为 8 个
+KEY_LENGTHS = {
+    'ontroller': 8,
+    'nageki': 10,
+}
+
+INT16_MIN = -32768
+INT16_MAX = 32767
+
+
+class FrameError(ValueError):
+    """帧格式错误"""
+
+
+def clamp_int16(value):
+    return min(max(int(value), INT16_MIN), INT16_MAX)
+
+
+def slot_device_id(device_name, device_slot):
+    """多设备 hid_reader 和数据报入口的设备 id，页面地址为 /device/<device_id>/"""
+    return f"{device_name}_{device_slot}"
+
+
+def switch_value(switch):
+    """simgeki 的 switches 以 '0b...' 字符串发送"""
+    if isinstance(switch, str):
+        return int(switch, 2)
+    return switch
+
+
+def encode_frame(data, device_slot=0, seq=0):
+    """
+    将 hid_reader 发送的数据编码为二进制帧
+
+    参数:
+        data: 与 JSON 中 'data' 字段相同的字典
+        device_slot: 设备槽位
+        seq: 序号（uint32，自动回绕）
+    """
+    device_name = data['DEVICE_NAME']
+    kind = DEVICE_KINDS[device_name]
+    status = data.get('device_status')
+    if status is not None:
+        return FRAME.pack(FRAME_MAGIC, WIRE_VERSION, STATUS_KIND, device_slot, seq & 0xFFFFFFFF,
+                          kind, 0, 0, DEVICE_STATUS.index(status))
+    flags = 0
+    if device_name in ('io4', 'simgeki'):
+        switches = data['switches']
+        buttons = switch_value(switches[0]) | (switch_value(switches[1]) << 16)
+        rotary = data['rotary']
+        lever = rotary[1]
+        sub_pos = rotary[0]
+        flags = data.get('system_status', 0)
+    elif device_name == 'yuangeki':
+        buttons = data.get('buttons', 0)
+        lever = data['x']
+        sub_pos = 0
+    else:
+        buttons = data.get('key_bits')
+        if buttons is None:
+            buttons = 0
+            for i, char in enumerate(data['key'][:KEY_LENGTHS[device_name]]):
+                if char == '1':
+                    buttons |= 1 << i
+        lever = data['pos']
+        sub_pos = data['sub_pos']
+        flags = data.get('idk', 0)
+    return FRAME.pack(FRAME_MAGIC, WIRE_VERSION, kind, device_slot, seq & 0xFFFFFFFF,
+                      buttons, clamp_int16(lever), clamp_int16(sub_pos), flags)
+
+
+def decode_frame(frame):
+    """
+    解码二进制帧
+
+    返回:
+        (device_slot, seq, data)，字段与 JSON 中的 'data' 相同，但按键直接给出整数：
+        switches 为整数，ontroller/nageki 用 key_bits 代替 key 字符串
+    """
+    if len(frame) != FRAME.size:
+        raise FrameError(f'帧长度错误: {len(frame)}')
+    magic, version, kind, device_slot, seq, buttons, lever, sub_pos, flags = FRAME.unpack(frame)
+    if magic != FRAME_MAGIC or version != WIRE_VERSION:
+        raise FrameError(f'不支持的帧: magic={magic} version={version}')
+    if kind == STATUS_KIND:
+        device_name = DEVICE_NAMES.get(buttons)
+        if device_name is None:
+            raise FrameError(f'未知设备类型: {buttons}')
+        return device_slot, seq, {'DEVICE_NAME': device_name, 'device_status': DEVICE_STATUS[flags & 1]}
+    device_name = DEVICE_NAMES.get(kind)
+    if device_name is None:
+        raise FrameError(f'未知设备类型: {kind}')
+
+    if device_name in ('io4', 'simgeki'):
+        data = {
+            'rotary': [sub_pos, lever, 0, 0],
+            'switches': [buttons & 0xFFFF, buttons >> 16],
+            'system_status': flags,
+        }
+    elif device_name == 'yuangeki':
+        data = {
+            'x': lever,
+            'buttons': buttons,
+        }
+    else:
+        data = {
+            'sub_pos': sub_pos,
+            'pos': lever,
+            'key_bits': buttons & ((1 << KEY_LENGTHS[device_name]) - 1),
+            'idk': flags,
+        }
+    data['DEVICE_NAME'] = device_name
+    return device_slot, seq, data
+
+
+def decode_display_frame(frame):
+    """解码显示更新帧，返回 [(image_id, visible), ...]"""
+    return list(zip(frame[0::2], frame[1::2]))
+
+
+def new_generation():
+    """hid_reader 每次启动时的 generation（非 0 的随机 uint32）"""
+    return int.from_bytes(os.urandom(4), 'little') or 1
+
+
+def encode_display_frame(events, image_ids):
+    """
+    将显示事件编码为页面使用的二进制帧
+
+    参数:
+        events: 显示事件列表 [{'key': ..., 'visible': ...}]
+        image_ids: key -> image_id（0~255）
+    """
+    frame = bytearray(len(events) * 2)
+    frame[0::2] = bytes(image_ids[event['key']] for event in events)
+    frame[1::2] = bytes(event['visible'] for event in events)
+    return bytes(frame)
+
+
+def parse_endpoint(endpoint):
+    """
+    解析本地数据报入口地址
+
+    'udp:127.0.0.1:8765'          -> (AF_INET, ('127.0.0.1', 8765))
+    'unix:/tmp/ongeki-hid.sock'   -> (AF_UNIX, '/tmp/ongeki-hid.sock')，Windows 不支持
+    """
+    scheme, _, address = endpoint.partition(':')
+    if scheme == 'udp':
+        host, _, port = address.rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError(f'数据报入口地址错误: {endpoint}')
+        return socket.AF_INET, (host, int(port))
+    if scheme == 'unix':
+        if not hasattr(socket, 'AF_UNIX') or not address:
+            raise ValueError(f'不支持的数据报入口地址: {endpoint}')
+        return socket.AF_UNIX, address
+    raise ValueError(f'未知的数据报入口类型: {endpoint}')
+
+
+DATAGRAM = struct.Struct('<I')  # generation，后面是 bin1 帧
+
+STATE_MAGIC = b'OGS1'
+STATE_HEADER = struct.Struct('<4sII')  # magic generation slot_count
+STATE_SEQLOCK = struct.Struct('<I')
+STATE_SLOT_SIZE = STATE_SEQLOCK.size + FRAME.size
+DOORBELL = struct.Struct('<IB')  # generation slot
+STATE_READ_RETRIES = 100
+
+
+class StateSegment:
+    """
+    共享内存状态段
+    hid_reader 用 create() 创建并写入，服务器用 attach() 打开并读取
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        magic, self.generation, self.slot_count = STATE_HEADER.unpack_from(shm.buf, 0)
+        if magic != STATE_MAGIC:
+            shm.close()
+            raise FrameError(f'不是状态段: {shm.name}')
+
+    @staticmethod
+    def size(slot_count):
+        return STATE_HEADER.size + STATE_SLOT_SIZE * slot_count
+
+    @classmethod
+    def create(cls, name, slot_count=1):
+        """创建状态段，同名的段已存在（上次没有正常退出或服务器仍打开着）时重新使用"""
+        size = cls.size(slot_count)
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            shm = shared_memory.SharedMemory(name)
+            if shm.size < size:
+                shm.close()
+                shm.unlink()
+                shm = shared_memory.SharedMemory(name, create=True, size=size)
+        shm.buf[:size] = bytes(size)
+        generation = new_generation()
+        STATE_HEADER.pack_into(shm.buf, 0, STATE_MAGIC, generation, slot_count)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """打开 hid_reader 创建的状态段，不存在时抛出 FileNotFoundError"""
+        shm = shared_memory.SharedMemory(name)
+        if os.name == 'posix':
+            # 打开的一方不负责删除，否则服务器退出时 resource_tracker 会删除 hid_reader 的段
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    def slot_offset(self, slot):
+        if not 0 <= slot < self.slot_count:
+            raise FrameError(f'槽位超出范围: {slot}')
+        return STATE_HEADER.size + STATE_SLOT_SIZE * slot
+
+    def write(self, slot, frame):
+        """写入一个槽位的最新帧（只有一个写入者）"""
+        offset = self.slot_offset(slot)
+        buf = self.shm.buf
+        (lock,) = STATE_SEQLOCK.unpack_from(buf, offset)
+        STATE_SEQLOCK.pack_into(buf, offset, (lock + 1) & 0xFFFFFFFF)
+        buf[offset + STATE_SEQLOCK.size:offset + STATE_SLOT_SIZE] = frame
+        STATE_SEQLOCK.pack_into(buf, offset, (lock + 2) & 0xFFFFFFFF)
+
+    def read(self, slot):
+        """
+        读取一个槽位的最新帧
+        还没有写入过时返回 None，一直读到写入中的数据时抛出 FrameError
+        """
+        offset = self.slot_offset(slot)
+        buf = self.shm.buf
+        for _ in range(STATE_READ_RETRIES):
+            (before,) = STATE_SEQLOCK.unpack_from(buf, offset)
+            if before & 1:
+                continue
+            frame = bytes(buf[offset + STATE_SEQLOCK.size:offset + STATE_SLOT_SIZE])
+            (after,) = STATE_SEQLOCK.unpack_from(buf, offset)
+            if before == after:
+                return frame if before else None
+        raise FrameError(f'槽位 {slot} 一直在写入中')
+
+    def close(self):
+        """关闭状态段，创建者同时删除"""
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
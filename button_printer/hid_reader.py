@@ -1,7 +1,7 @@
 import asyncio
 import configparser
-import math
 import struct
+import threading
 import traceback
 from ctypes import cdll
 from datetime import datetime
@@ -9,10 +9,23 @@ from pynput import mouse
 import keyboard
 import websockets
 import json
+import socket
 import time
 import sys
 import os
 
+try:
+    from .hid_protocol import (
+        DATAGRAM, DOORBELL, WIRE_NAME, StateSegment, encode_frame, new_generation, parse_endpoint, slot_device_id,
+    )
+    from .lever import LeverCalibration
+except ImportError:
+    # 直接运行 hid_reader.py 时
+    from hid_protocol import (
+        DATAGRAM, DOORBELL, WIRE_NAME, StateSegment, encode_frame, new_generation, parse_endpoint, slot_device_id,
+    )
+    from lever import LeverCalibration
+
 config = configparser.ConfigParser()
 
 print("hid_reader 启动！")
@@ -30,8 +43,190 @@ def get_exe_dir():
         return os.path.dirname(os.path.abspath(__file__))
 
 
+IO4_REPORT = struct.Struct('<8h 4h 2B 2B 2H 2B 29x')  # 小端字节序，2B 2B 表示 2个 coin_data_t（每个2字节）
+NAGEKI_REPORT = struct.Struct('<10BhB10BB')  # 按钮 10B + 摇杆 h + 扫描 B + AimiId 10B + 测试按钮 B
+button_positions = [11, 12, 13, 14, 15, 16, 17, 18]  # 左侧→右侧
+
+
+def report_mask(*fields):
+    """
+    报告中与显示有关的位，按小端把整个报告看作一个整数
+
+    参数:
+        fields: (offset, size) 整段字节，或 (offset, size, bits) 小端字段中的部分位
+    """
+    mask = 0
+    for field in fields:
+        offset, size = field[:2]
+        bits = field[2] if len(field) > 2 else (1 << 8 * size) - 1
+        mask |= bits << 8 * offset
+    return mask
+
+
+class HIDDeviceDriver:
+    """
+    设备驱动：启动时解析一次，读取/解析/发送时不再按设备名分支
+
+    参数:
+        name: 设备名
+        vendor_id: HID设备厂商ID
+        product_id: HID设备产品ID
+        read_size: 每次读取的长度
+        report_struct: 预编译的 struct.Struct，不需要时为 None
+        decode: 解码函数 decode(driver, view)，返回发送给服务器的数据
+        open_by_path: 是否通过 find_device_path 打开设备
+        reopen_on_error: 读取失败后重新打开时是否按路径打开（彩虹台）
+        change_mask: 与显示有关的位（report_mask），只有这些位变化时才发送，None 时比较整个报告
+        fallback_mask: zero_mask 中的位全为 0 时改用的 change_mask（io4 没有旋转编码器时使用 analog）
+        zero_mask: 见 fallback_mask
+        wire_name: 发送时的设备名（hid_protocol.DEVICE_KINDS），默认与 name 相同
+    """
+
+    def __init__(self, name, vendor_id, product_id, read_size, report_struct, decode,
+                 open_by_path=False, reopen_on_error=False,
+                 change_mask=None, fallback_mask=None, zero_mask=0, wire_name=None):
+        self.name = name
+        self.wire_name = wire_name or name
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.read_size = read_size
+        self.report_struct = report_struct
+        self.decode = decode
+        self.open_by_path = open_by_path
+        self.reopen_on_error = reopen_on_error
+        self.change_mask = change_mask
+        self.fallback_mask = fallback_mask
+        self.zero_mask = zero_mask
+        # 比较时只需要读取到最后一个有关的字节
+        self.mask_length = (max(change_mask or 0, fallback_mask or 0).bit_length() + 7) // 8
+
+    def change_key(self, view):
+        """报告中与显示有关的部分（掩码后的整数），相同则不需要发送"""
+        if self.change_mask is None:
+            return bytes(view)
+        value = int.from_bytes(view[:self.mask_length], 'little')
+        if self.zero_mask and not value & self.zero_mask:
+            return value & self.fallback_mask
+        return value & self.change_mask
+
+    def parse(self, data):
+        """解析一个报告，memoryview + unpack_from 不产生中间拷贝"""
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)  # hid.device 返回的是 list
+        return self.decode(self, memoryview(data))
+
+
+def lever_pos(lever):
+    """N_FLAG=1 时摇杆方向取反"""
+    if N_FLAG == 1:
+        return -abs(lever)
+    return lever
+
+
+def decode_io4(driver, view):
+    unpacked = driver.report_struct.unpack_from(view)
+    lever = unpacked[8:12]
+    if lever == (0, 0, 0, 0):
+        lever = unpacked[:8]
+    return {
+        'rotary': list(lever),  # 4个int16_t (旋转编码器)，没有时为 analog
+        'switches': list(unpacked[16:18]),  # 2个uint16_t (开关状态)
+        'system_status': unpacked[18],  # uint8_t (系统状态)
+        'DEVICE_NAME': 'io4'
+    }
+
+
+def decode_simgeki(driver, view):
+    return {
+        'rotary': [view[1], view[2], 0, 0],
+        'switches': [f"0b{view[29] * 2 ** 8:016b}", f"0b{view[31]:08b}{view[30]:08b}"],
+        'system_status': view[32],
+        'DEVICE_NAME': 'simgeki'
+    }
+
+
+def decode_ontroller(driver, view):
+    return {
+        "sub_pos": view[2],  # int
+        "pos": lever_pos(view[1]),  # int
+        "key": f"{view[3]:08b}",  # str
+        'DEVICE_NAME': 'ontroller',
+        'idk': 0
+    }
+
+
+def decode_ontroller_idk(driver, view):
+    return {
+        "sub_pos": view[22],  # int
+        "pos": lever_pos(view[21]),  # int
+        "key": ''.join(['1' if view[pos] == 0x01 else '0' for pos in button_positions]),  # str
+        'DEVICE_NAME': 'ontroller',
+        'idk': 1
+    }
+
+
+def decode_nageki(driver, view):
+    unpacked = driver.report_struct.unpack_from(view)
+    lever = unpacked[10]
+    return {
+        "sub_pos": lever,  # int
+        "pos": lever_pos(lever),  # int
+        "key": ''.join(map(str, unpacked[:10])),  # str
+        'DEVICE_NAME': 'nageki',  # nyageki 与 nageki 格式相同
+        'idk': 0
+    }
+
+
+# 与显示有关的位，模拟量通道、投币、usb_status、AimiId、扫描等字节的变化不会发送
+# io4: analog 0-15  rotary 16-23  coin 24-27  switches 28-31  system_status 32  usb_status 33
+IO4_SWITCH_BITS = (
+    (28, 2, 1 << 8 | 1 << 9 | 1 << 12 | 1 << 13),  # switches[0]: LR RR LB LG
+    (30, 2, 1 << 6 | 1 << 7 | 1 << 8),  # switches[1]: RW RB RG
+    (32, 1),  # system_status (LW)
+)
+IO4_MASK = report_mask((16, 4), *IO4_SWITCH_BITS)  # rotary[0] rotary[1]
+IO4_ANALOG_MASK = report_mask((0, 4), *IO4_SWITCH_BITS)  # 没有旋转编码器时使用 analog[0] analog[1]
+IO4_ROTARY_ZERO = report_mask((16, 8))
+# simgeki: 摇杆 1-2  switches 29-31（位与 io4 相同）  system_status 32
+SIMGEKI_MASK = report_mask((1, 2), (29, 1, 1 << 0 | 1 << 1 | 1 << 4 | 1 << 5), (30, 2, 1 << 6 | 1 << 7 | 1 << 8), (32, 1))
+# ontroller: 摇杆 1  子位置 2  按键 3
+ONTROLLER_MASK = report_mask((1, 3))
+# ontroller(idk=1): 按键 11-18  摇杆 21  子位置 22
+ONTROLLER_IDK_MASK = report_mask((11, 8), (21, 2))
+# nageki: 按键 0-8（4 号按键不使用）  摇杆 10-11，扫描、AimiId、测试按钮不参与比较
+NAGEKI_MASK = report_mask((0, 4), (5, 4), (10, 2))
+
+DEVICE_DRIVERS = {
+    'io4': HIDDeviceDriver('io4', 0x0CA3, 0x0021, 63, IO4_REPORT, decode_io4, reopen_on_error=True,
+                           change_mask=IO4_MASK, fallback_mask=IO4_ANALOG_MASK, zero_mask=IO4_ROTARY_ZERO),
+    'simgeki': HIDDeviceDriver('simgeki', 0x0CA3, 0x0021, 63, None, decode_simgeki, open_by_path=True,
+                               change_mask=SIMGEKI_MASK),
+    'ontroller': HIDDeviceDriver('ontroller', 0x0E8F, 0x1002, 64, None, decode_ontroller,
+                                 change_mask=ONTROLLER_MASK),
+    'ontroller_idk': HIDDeviceDriver('ontroller_idk', 0x0E8F, 0x1002, 64, None, decode_ontroller_idk,
+                                     change_mask=ONTROLLER_IDK_MASK, wire_name='ontroller'),
+    'nageki': HIDDeviceDriver('nageki', 0x2341, 0x8036, 64, NAGEKI_REPORT, decode_nageki,
+                              change_mask=NAGEKI_MASK),
+    'nyageki': HIDDeviceDriver('nyageki', 0x2341, 0x8036, 64, NAGEKI_REPORT, decode_nageki, open_by_path=True,
+                               change_mask=NAGEKI_MASK, wire_name='nageki'),
+    'yuangeki': HIDDeviceDriver('yuangeki', 0, 0, 0, None, None),
+}
+
+
+def resolve_driver(device_name, idk):
+    """根据 config.ini 选择设备驱动"""
+    if device_name == 'ontroller' and idk == 1:
+        device_name = 'ontroller_idk'
+    if device_name not in DEVICE_DRIVERS:
+        raise ValueError('device_name error or device not supported')
+    return DEVICE_DRIVERS[device_name]
+
+
 try:
     config_path = os.path.abspath('config.ini')
+    if not os.path.exists(config_path):
+        # 在 Daphne 进程内运行时当前目录是项目根目录
+        config_path = os.path.join(get_exe_dir(), 'config.ini')
     # config_path = os.path.join(os.path.dirname(__file__), 'config.ini')
     # config_path = os.path.join(get_exe_dir(), 'config.ini')
     # print(config_path)
@@ -39,40 +234,46 @@ try:
     DEVICE_NAME = str(config.get('device', 'device_name'))
     idk = int(config.get('idk', 'idk'))
     fre = float(config.get('frequency', 'fre'))
+    # 自适应读取频率：ADAPTIVE=1 时输入空闲 IDLE_AFTER 秒后改为每 IDLE_FRE 秒读取一次
+    # 只用于 drain 模式：poll 模式每次只读一个报告，空闲时系统HID队列中积压的报告要很多个周期才能读完
+    ADAPTIVE = int(config.get('frequency', 'adaptive', fallback='0'))
+    IDLE_AFTER = float(config.get('frequency', 'idle_after', fallback='10'))
+    IDLE_FRE = float(config.get('frequency', 'idle_fre', fallback='0.1'))
+    # 读取模式 poll: 事件循环内定时读取  thread: 专用线程阻塞读取  drain: 每次读空积压报告
+    READER_MODE = config.get('reader', 'mode', fallback='poll')
+    READ_TIMEOUT = int(config.get('reader', 'timeout', fallback='100'))
+    # 发送格式 bin1: 二进制帧（服务器不支持时自动使用json）  json
+    WIRE = config.get('reader', 'wire', fallback=WIRE_NAME)
+    # 是否需要服务器对每条数据回复 processing_result
+    ACK = int(config.get('reader', 'ack', fallback='0'))
+    # 发送方式 websocket  datagram: bin1 帧直接发到服务器的本地数据报入口（settings.HID_DATAGRAM_ENDPOINT）
+    # shared_memory: 最新状态写入共享内存 SEGMENT，数据报入口只收到唤醒
+    TRANSPORT = config.get('reader', 'transport', fallback='websocket')
+    ENDPOINT = config.get('reader', 'endpoint', fallback='udp:127.0.0.1:8765')
+    SEGMENT = config.get('reader', 'segment', fallback='ongeki_hid_state')
     L_MAX = int(config.get('boundary', 'L_MAX'))
     R_MAX = int(config.get('boundary', 'R_MAX'))
     N_FLAG = int(config.get('boundary', 'N_FLAG'))
-    # 摇杆边界值设定 [L_MAX L2] [L2 L1] [L1 R1] [R1 R2] [R2 R_MAX]
     if L_MAX < R_MAX:
         temp = L_MAX
         L_MAX = R_MAX
         R_MAX = temp
-    space = math.ceil((L_MAX - R_MAX) / 5)
-    L_2 = L_MAX - space
-    L_1 = L_2 - space
-    R_1 = L_1 - space
-    R_2 = R_1 - space
+    # 摇杆死区：与上一次发送的位置相差小于 DEADBAND 时不算移动
+    DEADBAND = int(config.get('boundary', 'deadband', fallback='0'))
+    # 摇杆滞回：越过分区边界 HYSTERESIS 以上才切换分区
+    HYSTERESIS = int(config.get('boundary', 'hysteresis', fallback='0'))
     # print(idk)
-    if DEVICE_NAME == 'io4':
-        VENDOR_ID = 0x0CA3
-        PRODUCT_ID = 0x0021
-    elif DEVICE_NAME == 'ontroller':
-        VENDOR_ID = 0x0E8F
-        PRODUCT_ID = 0x1002
-    elif DEVICE_NAME == 'nageki':
-        VENDOR_ID = 0x2341
-        PRODUCT_ID = 0x8036
-    elif DEVICE_NAME == 'yuangeki':
-        VENDOR_ID = 0
-        PRODUCT_ID = 0
-    elif DEVICE_NAME == 'simgeki':
-        VENDOR_ID = 0x0CA3
-        PRODUCT_ID = 0x0021
-    elif DEVICE_NAME == 'nyageki':
-        VENDOR_ID = 0x2341
-        PRODUCT_ID = 0x8036
-    else:
-        raise ValueError('device_name error or device not supported')
+    # 多设备：逗号分隔的设备名列表，为空时只读取 device_name
+    DEVICES = [name.strip() for name in config.get('device', 'devices', fallback='').split(',') if name.strip()]
+    if not DEVICES:
+        DEVICES = [DEVICE_NAME]
+    DEVICE_NAME = DEVICES[0]
+    DRIVERS = [resolve_driver(name, idk) for name in DEVICES]
+    if len(DRIVERS) > 1 and any(not driver.decode for driver in DRIVERS):
+        raise ValueError('yuangeki 不能与其它设备一起读取')
+    DRIVER = DRIVERS[0]
+    VENDOR_ID = DRIVER.vendor_id
+    PRODUCT_ID = DRIVER.product_id
 
 except configparser.Error as e:
     print(e)
@@ -85,6 +286,8 @@ except ValueError as e:
 
 # hidapi.dll位置
 dll_path = os.path.abspath('hidapi.dll')
+if not os.path.exists(dll_path):
+    dll_path = os.path.join(get_exe_dir(), 'hidapi.dll')
 # dll_path = os.path.join(get_exe_dir(), 'hidapi.dll')
 # 加载hid
 try:
@@ -98,39 +301,122 @@ except Exception as e:
         file.write(str(e))
     print(f"加载失败: {e}")
     sys.exit()
-OUTPUT_T_FORMAT = '<8h 4h 2B 2B 2H 2B 29x'  # 小端字节序，2B 2B 表示 2个 coin_data_t（每个2字节）
-OUTPUT_T_FORMAT_sim = '<B 8H 4H 2B 2B 4B 2B 29x'  # 小端字节序
-button_positions = [11, 12, 13, 14, 15, 16, 17, 18]  # 左侧→右侧
 SIM_SYMBOL = 0x00
+DRAIN_MAX_REPORTS = 256  # drain模式单次最多读取的报告数，防止持续上报时无法退出
+# 摇杆停下后补发的报告数：services.show_lever 连续两个摇杆不动的报告后才显示手放下
+SETTLE_REPORTS = 2
+# 读取错误后立即重新打开的最小间隔(秒)，一直出错的设备交给热插拔线程按退避间隔重试
+REOPEN_INTERVAL = 1.0
+# yuangeki 键盘按键 -> 按下掩码的位（顺序与 services.BUTTON_KEYS 相同: LW LR LG LB RR RG RB RW）
+YUANGEKI_KEYS = {'s': 0, 'd': 1, 'f': 2, 'g': 3, 'h': 4, 'j': 5, 'k': 6, 'l': 7}
+
+
+def button_signature(unpacked_data):
+    """报告中的按键部分，用于判断两个报告之间按键是否变化"""
+    if 'switches' in unpacked_data:
+        return tuple(unpacked_data['switches']), unpacked_data.get('system_status')
+    return unpacked_data.get('key')
+
+
+class PollScheduler:
+    """
+    基于 perf_counter_ns 截止时间的定时读取
+    每个周期的截止时间由上一个截止时间推算，处理耗时和定时器误差不会累积；
+    落后超过一个周期时不追赶，从当前时间重新开始。
+
+    参数:
+        interval: 读取周期(秒)
+        idle_interval: 空闲时的读取周期(秒)，None 表示不降低频率
+        idle_after: 多少秒没有输入算空闲
+    """
+
+    def __init__(self, interval, idle_interval=None, idle_after=10):
+        self.interval_ns = int(interval * 1e9)
+        self.idle_interval_ns = int(idle_interval * 1e9) if idle_interval else None
+        self.idle_after_ns = int(idle_after * 1e9)
+        self.deadline = None
+        self.last_activity = time.perf_counter_ns()
+        self.idle = False
+
+        # 统计
+        self.late = 0  # 落后超过一个周期的次数
+
+    def activity(self):
+        """有输入时调用，恢复正常读取频率"""
+        self.last_activity = time.perf_counter_ns()
+        if self.idle:
+            self.idle = False
+            print("⏩ 检测到输入，恢复正常读取频率")
+
+    def period(self, now):
+        if self.idle_interval_ns is None:
+            return self.interval_ns
+        if not self.idle and now - self.last_activity >= self.idle_after_ns:
+            self.idle = True
+            print(f"💤 输入空闲，读取周期改为 {self.idle_interval_ns / 1e6:.0f}ms")
+        return self.idle_interval_ns if self.idle else self.interval_ns
+
+    async def wait(self):
+        """等待到下一个截止时间"""
+        now = time.perf_counter_ns()
+        if self.deadline is None:
+            self.deadline = now
+        self.deadline += self.period(now)
+        delay = self.deadline - now
+        if delay <= 0:
+            self.late += 1
+            self.deadline = now
+            await asyncio.sleep(0)
+        else:
+            await asyncio.sleep(delay / 1e9)
 
 
-def parse_output_sim(data: bytes):
-    unpacked = struct.unpack(OUTPUT_T_FORMAT, data)
-    return {
-        'analog': unpacked[:8],
-        'rotary': unpacked[8:12],
-        'switches': unpacked[16:18],
-        'system_status': unpacked[18],
-        'usb_status': unpacked[19],
-    }
+def get_lever(unpacked_data):
+    """报告中的摇杆位置和子位置"""
+    if 'rotary' in unpacked_data:
+        return unpacked_data['rotary'][1], unpacked_data['rotary'][0]
+    return unpacked_data['pos'], unpacked_data['sub_pos']
 
 
-def parse_output_data(data):
-    # 解析前 24 字节（按钮 10B + 摇杆 H + 扫描 B + AimiId 10B + 测试按钮 B）
-    fmt = "<10BhB10BB"  # 小端序
-    unpacked = struct.unpack(fmt, data[:24])
-    buttons = unpacked[:10]
-    lever = unpacked[10]
-    scan = unpacked[11]
-    aimi_id = unpacked[12:22]
-    opt_button = unpacked[22]
-    return buttons, lever, scan, aimi_id, opt_button
+def set_lever(unpacked_data, position, sub_pos):
+    if 'rotary' in unpacked_data:
+        unpacked_data['rotary'][1] = position
+        unpacked_data['rotary'][0] = sub_pos
+    else:
+        unpacked_data['pos'] = position
+        unpacked_data['sub_pos'] = sub_pos
+
+
+class DeviceEnumerator:
+    """
+    hid.enumerate() 的缓存
+    设备断开前一直使用缓存的枚举结果，invalidate()（设备变化信号）之后的第一次查找才重新枚举
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cache = None
+        self.enumerations = 0  # 实际枚举次数
+
+    def devices(self):
+        with self.lock:
+            if self.cache is None:
+                self.cache = hid.enumerate()
+                self.enumerations += 1
+            return self.cache
+
+    def invalidate(self):
+        with self.lock:
+            self.cache = None
+
+
+ENUMERATOR = DeviceEnumerator()
 
 
 def find_device_path(interface_number=4):
     """动态查找设备路径"""
 
-    devices = hid.enumerate()
+    devices = ENUMERATOR.devices()
 
     target_devices = []
 
@@ -149,12 +435,113 @@ def find_device_path(interface_number=4):
     if len(target_devices) == 1:
         device_info = target_devices[0]
         return device_info['path']
+    elif not target_devices:
+        raise KeyError('找不到设备')
     else:
         raise KeyError('具有多个相同vid pid interface_number=4 或者 usage == 3072的设备')
 
 
+def find_device_paths(driver, interface_number=4):
+    """
+    与驱动匹配的所有设备路径，按路径排序，多设备时第 i 个相同的设备使用第 i 个路径
+    按路径打开的设备与 find_device_path 的条件相同，其它设备每个只取接口号最小的一个接口
+    """
+    devices = [device for device in ENUMERATOR.devices()
+               if device['vendor_id'] == driver.vendor_id and device['product_id'] == driver.product_id]
+    if driver.open_by_path or driver.reopen_on_error:
+        devices = [device for device in devices
+                   if (device['interface_number'] == interface_number and device['usage'] == 4) or
+                   device['usage'] == 3072 or device['usage'] == 0x0004]
+    elif devices:
+        first_interface = min(device['interface_number'] for device in devices)
+        devices = [device for device in devices if device['interface_number'] == first_interface]
+    return sorted({device['path'] for device in devices})
+
+
+class HotplugWatcher:
+    """
+    热插拔线程
+    设备读取失败（或启动时没有插入）时调用 device_lost()，本线程立即用缓存的路径重新打开一次，
+    失败后让枚举缓存失效，按 min_delay ~ max_delay 的退避间隔重新枚举并打开，
+    重新打开和 sleep 都不在事件循环中进行
+    """
+
+    def __init__(self, reader, min_delay=0.05, max_delay=1.0):
+        self.reader = reader  # 负责连接的读取器，设备状态通过它通知服务器
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.lost = {}  # 设备 -> 断开时间 perf_counter_ns
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # 统计：每次重新连接的耗时(ms)
+        self.reconnect_ms = []
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="hid-hotplug", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=1)
+        self.thread = None
+
+    def device_lost(self, device):
+        """设备读取失败（任何线程中调用），第一次报告时返回 True"""
+        with self.lock:
+            if device in self.lost:
+                return False
+            self.lost[device] = time.perf_counter_ns()
+        self.wakeup.set()
+        return True
+
+    def run(self):
+        delay = self.min_delay
+        while not self.stop_event.is_set():
+            self.wakeup.wait(timeout=delay if self.lost else None)
+            self.wakeup.clear()
+            if self.stop_event.is_set():
+                break
+            with self.lock:
+                lost = list(self.lost.items())
+            failed = False
+            for device, lost_at in lost:
+                try:
+                    device.reopen_hid_device()
+                except Exception:
+                    failed = True
+                    continue
+                elapsed_ms = (time.perf_counter_ns() - lost_at) / 1e6
+                with self.lock:
+                    del self.lost[device]
+                self.reconnect_ms.append(elapsed_ms)
+                print(f"🔌 {device.device_id} 已重新连接，耗时 {elapsed_ms:.0f}ms")
+                self.reader.notify_device_status(device, True)
+            if failed:
+                # 设备可能已经换了路径，下一次重新枚举
+                ENUMERATOR.invalidate()
+                delay = min(delay * 2, self.max_delay)
+            else:
+                delay = self.min_delay
+
+    def stats(self):
+        if not self.reconnect_ms:
+            return None
+        return {
+            'reconnects': len(self.reconnect_ms),
+            'avg_ms': sum(self.reconnect_ms) / len(self.reconnect_ms),
+            'max_ms': max(self.reconnect_ms),
+        }
+
+
 class RealHIDWebSocketReader:
-    def __init__(self, vendor_id=VENDOR_ID, product_id=PRODUCT_ID, websocket_url="ws://127.0.0.1:8000/ws/hid/"):
+    def __init__(self, vendor_id=VENDOR_ID, product_id=PRODUCT_ID, websocket_url="ws://127.0.0.1:8000/ws/hid/",
+                 driver=None, device_slot=0, device_index=None, device_id=None):
         """
         初始化真实 HID 设备读取器
 
@@ -162,9 +549,18 @@ class RealHIDWebSocketReader:
             vendor_id: HID设备厂商ID (十六进制)
             product_id: HID设备产品ID (十六进制)
             websocket_url: WebSocket服务器地址
+            driver: 设备驱动，None 时按 config.ini 创建（包括 [device] devices 中的其它设备）
+            device_slot: 多设备时设备在列表中的位置（帧头的 device_slot）
+            device_index: 多设备时在相同设备中的序号（find_device_paths），None 时只有一个设备
+            device_id: 设备 id，None 时为 hid_<vid>_<pid>
         """
         self.x = None
         self.listener = None
+        # yuangeki 键盘监听（整个运行期间只安装一次）
+        self.keyboard_hook = None
+        self.buttons = 0  # 按下掩码
+        self.loop = None
+        self.input_event = None  # 鼠标/键盘有输入时由监听线程设置
         self.vendor_id = vendor_id
         self.product_id = product_id
         self.websocket_url = websocket_url
@@ -177,13 +573,50 @@ class RealHIDWebSocketReader:
 
         # HID设备
         self.hid_device = None
+        self.driver = driver or DRIVER
+        self.device_index = device_index
+        self.device_path = None  # 多设备时打开的路径，重新连接时优先使用
+        self.last_reopen = None  # 上一次读取错误后立即重新打开的时间（perf_counter）
         self.polling_interval = fre  # 25ms读取延迟
 
-        # 数据
+        # 读取线程（thread模式）
+        self.reader_mode = READER_MODE if self.driver.decode else 'poll'  # yuangeki没有HID设备
+        idle_fre = IDLE_FRE if ADAPTIVE and self.reader_mode == 'drain' else None
+        self.scheduler = PollScheduler(fre, idle_fre, IDLE_AFTER)
+        self.read_timeout = READ_TIMEOUT
+        self.reader_thread = None
+        self.reader_stop = threading.Event()
+        self.report_queue = None
+
+        # 二进制帧（连接时与服务器协商）
+        self.wire = WIRE
+        self.use_binary = False
+        self.device_slot = device_slot
+        self.seq = 0
+        self.ack = ACK
+
+        # drain模式被合并（未发送）的报告数
+        self.coalesced_reports = 0
+
+        # 数据：上一次发送的报告中与显示有关的部分（HIDDeviceDriver.change_key）
         self.data = None
+        self.unchanged_reports = 0  # 与显示有关的部分没有变化而没有发送的报告数
+
+        # 摇杆死区/滞回
+        self.deadband = DEADBAND
+        self.hysteresis = HYSTERESIS
+        self.lever_calibration = None  # 第一次收到报告时按设备创建
+        self.sent_lever = None  # 上一次发送的 (摇杆位置, 子位置)
+        self.sent_buttons = None  # 上一次发送的按键部分
+        self.lever_suppressed = 0  # 被死区/滞回过滤掉的报告数
+
+        # 摇杆停下后的补发（没有变化的报告不再发送，服务器需要补发的报告才能显示手放下）
+        self.settle_lever = None  # 上一次发送的 (摇杆位置, 子位置)
+        self.settle_data = None  # 需要补发的报告
+        self.settle_at = None  # 补发时间（perf_counter），None 表示不需要补发
 
         # 设备信息
-        self.device_id = f"hid_{vendor_id:04x}_{product_id:04x}"
+        self.device_id = device_id or f"hid_{vendor_id:04x}_{product_id:04x}"
         if vendor_id != 0:
             print(f"  初始化 HID 设备读取器")
             print(f"  设备: {vendor_id:04x}:{product_id:04x}")
@@ -192,11 +625,72 @@ class RealHIDWebSocketReader:
             print(f"  初始化 yuangeki 读取器")
             print(f"  WebSocket: {websocket_url}")
 
+        # 多设备：本读取器读取第一个设备并负责连接，其它设备只负责读取，数据通过本读取器的连接发送
+        self.devices = [self]
+        self.owner = self
+        # 热插拔线程（负责连接的读取器在 run() 中创建，所有设备共用）
+        self.watcher = None
+        self.status_tasks = set()
+        if driver is None and len(DRIVERS) > 1:
+            self.add_config_devices()
+
+    def add_config_devices(self):
+        """按 config.ini [device] devices 创建其它设备，每个设备一个读取线程"""
+        counts = {}
+        for slot, driver in enumerate(DRIVERS):
+            model = (driver.vendor_id, driver.product_id)
+            index = counts.get(model, 0)
+            counts[model] = index + 1
+            device_id = slot_device_id(driver.wire_name, slot)
+            if slot == 0:
+                self.device_index = index
+                self.device_id = device_id
+                continue
+            device = RealHIDWebSocketReader(
+                driver.vendor_id, driver.product_id, self.websocket_url,
+                driver=driver, device_slot=slot, device_index=index, device_id=device_id)
+            device.owner = self
+            self.devices.append(device)
+        # 每个设备在自己的线程中阻塞读取，增加设备不会拖慢其它设备
+        for device in self.devices:
+            device.reader_mode = 'thread'
+        print(f"🎮 多设备: {', '.join(device.device_id for device in self.devices)}")
+
+    def find_path(self):
+        """本设备的路径，多设备时为第 device_index 个相同的设备"""
+        if self.device_index is None:
+            return find_device_path()
+        paths = find_device_paths(self.driver)
+        if self.device_index >= len(paths):
+            raise KeyError(f'找不到第 {self.device_index + 1} 个 {self.driver.name} 设备')
+        return paths[self.device_index]
+
+    def find_reopen_path(self):
+        """
+        多设备重新连接时的路径
+        一个设备拔出后其它相同设备的序号会改变，所以优先使用原来的路径，
+        原来的路径不在时（插到了别的 USB 口）使用没有被其它设备占用的路径
+        """
+        paths = find_device_paths(self.driver)
+        if self.device_path in paths:
+            return self.device_path
+        in_use = {device.device_path for device in self.owner.devices if device is not self}
+        for path in paths:
+            if path not in in_use:
+                return path
+        raise KeyError(f'找不到 {self.device_id} 设备')
+
     async def connect_to_websocket(self):
         """连接到WebSocket服务器"""
         try:
             # 添加查询参数标识为HID读取器
-            query_params = f"?client_type=hid_reader&device_id={self.device_id}"
+            query_params = "?client_type=hid_reader"
+            # 多设备时按槽位顺序带上所有设备 id
+            query_params += ''.join(f"&device_id={device.device_id}" for device in self.devices)
+            if self.wire != 'json':
+                query_params += f"&wire={self.wire}"
+            if not self.ack:
+                query_params += "&ack=0"
             full_url = f"{self.websocket_url}{query_params}"
 
             print(f"🔗 正在连接到 WebSocket: {full_url}")
@@ -204,10 +698,14 @@ class RealHIDWebSocketReader:
             self.is_connected = True
             self.reconnect_attempts = 0
 
-            # 等待连接确认消息
-            response = await self.websocket.recv()
-            response_data = json.loads(response)
+            # 等待连接确认消息（之前可能还有 performance_mode）
+            response_data = {}
+            while response_data.get('type') != 'connection_established':
+                response = await self.websocket.recv()
+                response_data = json.loads(response)
             print(f"✅ WebSocket 连接成功: {response_data.get('message')}")
+            self.use_binary = self.wire == WIRE_NAME and response_data.get('wire') == WIRE_NAME
+            print(f"📦 数据格式: {WIRE_NAME if self.use_binary else 'json'}")
 
             return True
 
@@ -215,27 +713,59 @@ class RealHIDWebSocketReader:
             print(f"❌ WebSocket 连接失败: {e}")
             return False
 
-    def on_move(self, x):
-        self.x = (x // 10) * -10  # 防抖动 负数保证方向正确
+    def on_move(self, x, y):
+        x = (x // 10) * -10  # 防抖动 负数保证方向正确
+        if x != self.x:
+            self.x = x
+            self.notify_input()
+
+    def on_key(self, event):
+        """键盘监听线程中调用，更新按下掩码"""
+        bit = YUANGEKI_KEYS.get((event.name or '').lower())
+        if bit is None:
+            return
+        if event.event_type == keyboard.KEY_DOWN:
+            buttons = self.buttons | (1 << bit)
+        else:
+            buttons = self.buttons & ~(1 << bit)
+        if buttons != self.buttons:
+            self.buttons = buttons
+            self.notify_input()
+
+    def notify_input(self):
+        """从监听线程唤醒事件循环"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.input_event.set)
 
     def initialize_hid_device(self):
         """初始化真实HID设备"""
         try:
-            if DEVICE_NAME == 'yuangeki':
+            if not self.driver.decode:  # yuangeki
+                self.loop = asyncio.get_running_loop()
+                self.input_event = asyncio.Event()
+                self.x = (L_MAX + R_MAX) / 2
                 self.listener = mouse.Listener(on_move=self.on_move)
                 self.listener.start()
-                self.x = (L_MAX + R_MAX) / 2
+                self.keyboard_hook = keyboard.hook(self.on_key)
                 print("成功连接 yuangeki")
                 return True
             print(f"🎮 正在打开 HID 设备: {self.vendor_id:04x}:{self.product_id:04x}")
 
             # 查找并打开设备
             # self.hid_device = hid.Device(self.vendor_id, self.product_id)
+            if self.device_index is not None:
+                # 多设备：相同的设备只能按路径区分
+                self.device_path = self.find_path()
+                self.hid_device = self.open_path(self.device_path)
+                if self.reader_mode == 'drain':
+                    self.set_nonblocking()
+                print(f"✅ HID设备打开成功: {self.device_id}")
+                return True
             try:
                 self.hid_device = hid.Device(self.vendor_id, self.product_id)
             except:
                 self.hid_device = hid.device()
-            if DEVICE_NAME == 'simgeki' or DEVICE_NAME == 'nyageki':
+            if self.driver.open_by_path:
                 device_path = find_device_path()
                 try:
                     self.hid_device.open_path(device_path)
@@ -247,6 +777,8 @@ class RealHIDWebSocketReader:
                 except:
                     pass
 
+            if self.reader_mode == 'drain':
+                self.set_nonblocking()
             print(f"✅ HID设备打开成功:")
             return True
 
@@ -261,204 +793,281 @@ class RealHIDWebSocketReader:
             print(f"加载失败: {e}")
             return False
 
+    def open_path(self, path):
+        """按路径打开设备（hid.Device / hid.device 两种接口）"""
+        try:
+            return hid.Device(path=path)
+        except:
+            device = hid.device()
+            device.open_path(path)
+            return device
+
+    def reopen_hid_device(self):
+        """
+        重新打开断开的设备（热插拔线程中调用），失败时抛出异常
+        按路径打开的设备使用缓存的枚举结果查找路径
+        """
+        if self.device_index is not None:
+            path = self.find_reopen_path()
+            device = self.open_path(path)
+            self.device_path = path
+        elif self.driver.open_by_path or self.driver.reopen_on_error:
+            device = self.open_path(self.find_path())
+        else:
+            try:
+                device = hid.Device(self.vendor_id, self.product_id)
+            except:
+                device = hid.device()
+                device.open(self.vendor_id, self.product_id)
+        # 重新连接后的第一个报告一定发送
+        self.data = None
+        self.hid_device = device
+        if self.reader_mode == 'drain':
+            self.set_nonblocking()
+
+    def device_lost(self, error):
+        """
+        读取失败：关闭设备并立即重新打开一次（偶发的读取错误不通知页面），
+        仍然失败时由热插拔线程重新打开，页面显示设备断开
+        """
+        print(f"❌ HID读取错误: {self.device_id} {error}")
+        self.cleanup_hid_device()
+        now = time.perf_counter()
+        if self.last_reopen is None or now - self.last_reopen >= REOPEN_INTERVAL:
+            self.last_reopen = now
+            try:
+                self.reopen_hid_device()
+                print(f"🔄 {self.device_id} 已重新打开")
+                return
+            except Exception:
+                pass
+        watcher = self.owner.watcher
+        if watcher is not None and watcher.device_lost(self):
+            self.owner.notify_device_status(self, False)
+
+    def notify_device_status(self, device, connected):
+        """设备断开 / 重新连接（可以在任何线程中调用），在事件循环中发送给服务器"""
+        if self.loop is None:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.send_device_status, device, connected)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def send_device_status(self, device, connected):
+        status = {'DEVICE_NAME': device.driver.wire_name, 'device_status': 'connected' if connected else 'lost'}
+        task = self.loop.create_task(self.send_hid_data(status, device))
+        self.status_tasks.add(task)
+        task.add_done_callback(self.status_tasks.discard)
+
+    def read_raw_report(self, timeout_ms=None):
+        """
+        读取一个原始报告
+        设备断开时返回 None，读取失败时抛出异常（由调用方交给热插拔线程）
+
+        参数:
+            timeout_ms: 阻塞读取超时(ms)，None 表示沿用设备默认的读取方式
+        """
+        device = self.hid_device
+        if not device:
+            return None
+        # 大多数HID设备报告长度为64字节
+        if timeout_ms is None:
+            return device.read(self.driver.read_size)
+        return device.read(self.driver.read_size, timeout_ms)
+
+    def set_nonblocking(self):
+        """设置非阻塞读取，drain模式下读空队列时立即返回"""
+        try:
+            self.hid_device.set_nonblocking(1)  # hidapi
+        except AttributeError:
+            self.hid_device.nonblocking = True  # hid
+
+    def handle_report(self, data):
+        """与显示有关的部分变化时解析报告，否则返回 None"""
+        # 没有数据可用是正常的（非阻塞模式）
+        if not data:
+            return None
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)  # hid.device 返回的是 list
+        key = self.driver.change_key(memoryview(data))
+        if key == self.data:
+            self.unchanged_reports += 1
+            return None
+        self.data = key
+
+        # 打印原始数据用于调试
+        hex_data = ' '.join(f'{b:02x}' for b in data)
+        print(f"📥 原始HID数据: [{hex_data}]")
+
+        # 解析数据
+        unpacked_data = self.parse_hid_data(data)
+        # print(f"解析数据unpacked_data {unpacked_data}")
+        return self.filter_lever(unpacked_data)
+
+    def filter_lever(self, unpacked_data):
+        """
+        摇杆死区/滞回
+        小于死区的移动、没有越过分区边界 hysteresis 的分区切换都保持上一次发送的摇杆值，
+        此时按键也没有变化则不发送（返回 None）
+        """
+        if not self.deadband and not self.hysteresis:
+            return unpacked_data
+        position, sub_pos = get_lever(unpacked_data)
+        buttons = button_signature(unpacked_data)
+        if self.sent_lever is not None:
+            last_position = self.sent_lever[0]
+            if self.lever_calibration is None:
+                self.lever_calibration = LeverCalibration.from_config(config, unpacked_data['DEVICE_NAME'])
+            zone_key = self.lever_calibration.zone_key
+            hold = abs(position - last_position) < self.deadband
+            if not hold and self.hysteresis and zone_key(position) != zone_key(last_position):
+                # 往回退 hysteresis 仍在新分区内才切换
+                step = self.hysteresis if position > last_position else -self.hysteresis
+                hold = zone_key(position - step) != zone_key(position)
+            if hold:
+                if buttons == self.sent_buttons:
+                    self.lever_suppressed += 1
+                    return None
+                position, sub_pos = self.sent_lever
+                set_lever(unpacked_data, position, sub_pos)
+        self.sent_lever = (position, sub_pos)
+        self.sent_buttons = buttons
+        return unpacked_data
+
+    def track_settle(self, unpacked_data):
+        """记录发送的报告，摇杆移动后 fre 秒没有再移动时由 settle_report() 补发最后的状态"""
+        lever = get_lever(unpacked_data)
+        if lever != self.settle_lever:
+            self.settle_lever = lever
+            self.settle_at = time.perf_counter() + self.polling_interval
+        if self.settle_at is not None:
+            self.settle_data = unpacked_data
+
+    def settle_report(self):
+        """到了补发时间时返回需要补发的报告，否则返回 None"""
+        if self.settle_at is None or time.perf_counter() < self.settle_at:
+            return None
+        self.settle_at = None
+        return self.settle_data
+
     def read_hid_data(self):
         """读取真实HID设备数据"""
         try:
-            if not self.hid_device:
-                return None
-            data = None
-            # 读取数据（非阻塞）
-            # 大多数HID设备报告长度为64字节
-            if DEVICE_NAME == 'io4':
-                try:
-                    data = self.hid_device.read(63)
-                except:
-                    path = find_device_path()
-                    try:
-                        self.hid_device = hid.Device(path=path)
-                    except:
-                        self.hid_device = hid.device()
-                        self.hid_device.open_path(path)
-                    data = self.hid_device.read(63)
-            elif DEVICE_NAME == 'ontroller':
-
-                if idk == 1:
-                    data = self.hid_device.read(5)
-                else:
-                    data = self.hid_device.read(64)
-
-            elif DEVICE_NAME == 'nageki':
-                data = self.hid_device.read(64)
-            elif DEVICE_NAME == 'nyageki':
-                data = self.hid_device.read(64)
-            elif DEVICE_NAME == 'simgeki':
-                data = self.hid_device.read(63)
-                # print(data)
-
-            if self.data != data:
-                self.data = data
-                if data:
-                    # 打印原始数据用于调试
-                    hex_data = ' '.join(f'{b:02x}' for b in data)
-                    print(f"📥 原始HID数据: [{hex_data}]")
-
-                    # 解析数据
-                    unpacked_data = self.parse_hid_data(bytes(data))
-                    # print(f"解析数据unpacked_data {unpacked_data}")
-                    return unpacked_data
-                else:
-                    # 没有数据可用是正常的（非阻塞模式）
-                    return None
+            return self.handle_report(self.read_raw_report())
 
         except Exception as e:
-            print(f"❌ HID读取错误: {e}")
-            # 如果读取失败，尝试重新初始化设备
-            self.reinitialize_hid_device()
+            # 读取失败，交给热插拔线程重新打开，不阻塞事件循环
+            self.device_lost(e)
             return None
 
-    def parse_hid_data(self, data):
-        """解析输出数据，仅提取指定字段"""
-        if DEVICE_NAME == 'io4':
-            unpacked = struct.unpack(OUTPUT_T_FORMAT, data)
-            lever = tuple(unpacked[8:12])
-            if lever == (0, 0, 0, 0):
-                lever = tuple(unpacked[:8])
-            return {
-                'rotary': lever,  # 后续4个int16_t (旋转编码器)
-                'switches': tuple(unpacked[16:18]),  # 2个uint16_t (开关状态)
-                'system_status': unpacked[18]  # uint8_t (系统状态)
-            }
+    def drain_hid_data(self):
+        """
+        读空系统HID队列中积压的报告，只保留最新状态
+        按键发生变化的报告会保留，批次内的按下-释放不会丢失
 
-        elif DEVICE_NAME == 'ontroller':
-            if idk == 0:
-                op = {
-                    "sub_pos": data[2],  # int
-                    "pos": data[1],  # int
-                    "key": f"{data[3]:08b}",  # str
-                }
-                return op
-            else:
-                binary_chars = []
-                for pos in button_positions:
-                    if data[pos] == 0x01:  # 按键按下
-                        binary_chars.append('1')
-                    else:  # 按键释放
-                        binary_chars.append('0')
-
-                op = {
-                    "sub_pos": data[22],  # int
-                    "pos": data[21],  # int
-                    "key": ''.join(binary_chars),  # str
-                }
-                return op
-
-        elif DEVICE_NAME == 'nageki' or DEVICE_NAME == 'nyageki':
-            b_data = bytes(data)
-            buttons, lever, scan, aimi_id, opt_button = parse_output_data(b_data)
-            button_s = ""
-            for i in range(len(buttons)):
-                button_s = button_s + str(buttons[i])
-            op = {
-                "sub_pos": lever,  # int
-                "pos": lever,  # int
-                "key": button_s,  # str
-            }
-            return op
-        elif DEVICE_NAME == 'simgeki':
-            # current_data = parse_output_sim(bytes(data))
-            key_list = []
-            sw1 = f"0b{data[29] * 2 ** 8:016b}"
-            sw2 = f"0b{data[31]:08b}{data[30]:08b}"
-            key_list.append(sw1)
-            key_list.append(sw2)
-            rotary = [data[1], data[2], 0, 0]
-            op = {
-                'rotary': tuple(rotary),  # 后续4个int16_t (旋转编码器)
-                'switches': key_list,  # list
-                'system_status': data[32]  # uint8_t (系统状态)
-            }
-            # print(f"op {op}")
-            return op
+        返回:
+            需要发送的报告列表（按时间顺序）
+        """
+        reports = []
+        pending = None
+        try:
+            for _ in range(DRAIN_MAX_REPORTS):
+                data = self.read_raw_report(0)
+                if not data:
+                    break
+                unpacked_data = self.handle_report(data)
+                if not unpacked_data:
+                    continue
+                if pending is not None:
+                    if button_signature(pending) == button_signature(unpacked_data):
+                        # 只有摇杆变化，旧状态直接被新状态覆盖
+                        self.coalesced_reports += 1
+                    else:
+                        reports.append(pending)
+                pending = unpacked_data
+        except Exception as e:
+            self.device_lost(e)
+        if pending is not None:
+            reports.append(pending)
+        return reports
 
-    def reinitialize_hid_device(self):
-        """重新初始化HID设备"""
-        print("🔄 尝试重新初始化HID设备...")
-        self.cleanup_hid_device()
-        time.sleep(1)
-        return self.initialize_hid_device()
+    def start_reader_thread(self, loop, report_queue):
+        """
+        启动专用读取线程，解析后的数据通过 call_soon_threadsafe 以 (设备, 数据) 放入队列
+        多设备时所有设备共用一个队列
+        """
+        self.report_queue = report_queue
+        self.reader_stop.clear()
+        self.reader_thread = threading.Thread(
+            target=self.reader_thread_loop, args=(loop,), name=f"hid-reader-{self.device_slot}", daemon=True)
+        self.reader_thread.start()
+        print(f"🧵 HID读取线程已启动: {self.device_id} (超时 {self.read_timeout}ms)")
+
+    def reader_thread_loop(self, loop):
+        """读取线程主循环：阻塞读取（带超时），不占用事件循环"""
+        while not self.reader_stop.is_set():
+            try:
+                if not self.hid_device:
+                    # 设备断开，等待热插拔线程重新打开
+                    self.reader_stop.wait(self.read_timeout / 1000)
+                    continue
+                unpacked_data = self.handle_report(self.read_raw_report(self.read_timeout))
+            except Exception as e:
+                self.device_lost(e)
+                continue
+            if unpacked_data:
+                try:
+                    loop.call_soon_threadsafe(self.report_queue.put_nowait, (self, unpacked_data))
+                except RuntimeError:
+                    # 事件循环已关闭
+                    break
+
+    def stop_reader_thread(self):
+        """停止读取线程"""
+        self.reader_stop.set()
+        if self.reader_thread and self.reader_thread.is_alive():
+            self.reader_thread.join(timeout=1)
+        self.reader_thread = None
+
+    def parse_hid_data(self, data):
+        """解析输出数据，仅提取指定字段"""
+        return self.driver.parse(data)
 
     def cleanup_hid_device(self):
         """清理HID设备"""
         if self.hid_device:
+            device = self.hid_device
+            self.hid_device = None
             try:
-                self.hid_device.close()
-                self.hid_device = None
+                device.close()
                 print("✅ HID设备已关闭")
             except:
                 pass
 
-    async def send_hid_data(self, unpacked_data):
-        """发送HID数据到WebSocket服务器"""
+    async def send_hid_data(self, unpacked_data, device=None):
+        """
+        发送HID数据到WebSocket服务器
+        device: 多设备时数据来自的设备，None 时为本读取器的设备
+        """
+        device = device or self
         try:
             if not self.is_connected or not self.websocket:
                 print("⚠️ WebSocket未连接，无法发送数据")
                 return False
-            serializable_data = None
-            if DEVICE_NAME == 'yuangeki':
-                serializable_data = {
-                    'type': 'hid_data',
-                    'timestamp': time.time(),
-                    'data': {
-                        'x': self.x,
-                        'DEVICE_NAME': DEVICE_NAME
-                    }
-                }
+            if self.use_binary:
+                self.seq += 1
+                await self.websocket.send(encode_frame(unpacked_data, device.device_slot, self.seq))
+                return True
+
             # 确保数据可以被 JSON 序列化
-            if DEVICE_NAME == "io4":
-                serializable_data = {
-                    'type': 'hid_data',
-                    'device_id': self.device_id,
-                    'timestamp': time.time(),
-                    'data': {
-                        'rotary': list(unpacked_data.get('rotary', (0, 0, 0, 0))),  # 转换为列表
-                        'switches': list(unpacked_data.get('switches', (0, 0))),  # 转换为列表
-                        'system_status': int(unpacked_data.get('system_status', 0)),  # 确保是整数
-                        'DEVICE_NAME': DEVICE_NAME
-                    }
-                }
-            elif DEVICE_NAME == "simgeki":
-                serializable_data = {
-                    'type': 'hid_data',
-                    'device_id': self.device_id,
-                    'timestamp': time.time(),
-                    'data': {
-                        'rotary': list(unpacked_data.get('rotary', (0, 0, 0, 0))),  # 转换为列表
-                        'switches': list(unpacked_data.get('switches', (0, 0))),  # 转换为列表
-                        'system_status': int(unpacked_data.get('system_status', 0)),  # 确保是整数
-                        'DEVICE_NAME': DEVICE_NAME
-                    }
-                }
-            elif DEVICE_NAME in ('nageki', 'ontroller', 'nyageki'):
-                if DEVICE_NAME == 'nyageki':
-                    device_name = 'nageki'
-                else:
-                    device_name = DEVICE_NAME
-                if N_FLAG == 1:
-                    pos = -abs(unpacked_data.get('pos'))
-                else:
-                    pos = unpacked_data.get('pos')
-                serializable_data = {
-                    'type': 'hid_data',
-                    'device_id': self.device_id,
-                    'timestamp': time.time(),
-                    'data': {
-                        "sub_pos": unpacked_data.get('sub_pos'),  # int
-                        "pos": pos,  # int
-                        "key": unpacked_data.get('key'),  # str
-                        'DEVICE_NAME': device_name,
-                        'idk': idk
-                    }
-                }
+            serializable_data = {
+                'type': 'hid_data',
+                'device_id': device.device_id,
+                'timestamp': time.time(),
+                'data': unpacked_data
+            }
 
             await self.websocket.send(json.dumps(serializable_data))
             # print(f"📤 发送数据: {serializable_data}")
@@ -478,6 +1087,20 @@ class RealHIDWebSocketReader:
             self.is_connected = False
             return False
 
+    async def send_report(self, unpacked_data, device=None):
+        """发送读取到的报告，并记录摇杆停下后需要补发的状态"""
+        device = device or self
+        device.track_settle(unpacked_data)
+        return await self.send_hid_data(unpacked_data, device)
+
+    async def send_settle(self, device=None):
+        """摇杆停下 fre 秒后补发 SETTLE_REPORTS 次最后的状态，服务器据此显示手放下"""
+        device = device or self
+        unpacked_data = device.settle_report()
+        if unpacked_data:
+            for _ in range(SETTLE_REPORTS):
+                await self.send_hid_data(unpacked_data, device)
+
     async def receive_messages(self):
         """接收WebSocket服务器消息"""
         try:
@@ -512,10 +1135,13 @@ class RealHIDWebSocketReader:
         """主运行循环"""
         print("🚀 启动真实 HID 设备读取器...")
 
-        # 初始化HID设备
-        if not self.initialize_hid_device():
+        # 初始化HID设备（多设备时全部打开），没有插入的设备之后由热插拔线程打开
+        missing = [device for device in self.devices if not device.initialize_hid_device()]
+        if missing and not self.driver.decode:  # yuangeki
             print("❌ HID设备初始化失败，退出")
             return
+        for device in missing:
+            print(f"⚠️ {device.device_id} 没有插入，插入后自动打开")
 
         # 连接WebSocket
         while self.reconnect_attempts < self.max_reconnect_attempts:
@@ -537,17 +1163,41 @@ class RealHIDWebSocketReader:
             last_ping_time = time.time()
             data_count = 0
 
+            if not self.driver.decode:  # yuangeki
+                await self.run_input_mode()
+                await receive_task
+                return
+
+            # 热插拔线程：读取失败的设备在该线程中重新打开，事件循环继续运行
+            self.loop = asyncio.get_running_loop()
+            self.watcher = HotplugWatcher(self)
+            self.watcher.start()
+            for device in missing:
+                if self.watcher.device_lost(device):
+                    self.notify_device_status(device, False)
+
+            if self.reader_mode == 'thread':
+                await self.run_thread_mode()
+                await receive_task
+                return
+
             print("开始数据读取循环...")
             while self.is_connected:
 
                 # 读取HID数据
-                if DEVICE_NAME != 'yuangeki':
-                    hid_data = self.read_hid_data()
+                if self.reader_mode == 'drain':
+                    # 积压的报告按顺序发送，只有最后一个由下面发送
+                    reports = self.drain_hid_data()
+                    for report in reports[:-1]:
+                        await self.send_report(report)
+                    hid_data = reports[-1] if reports else None
                 else:
-                    hid_data = None
-                    success = await self.send_hid_data(hid_data)
+                    hid_data = self.read_hid_data()
                 if hid_data:
-                    success = await self.send_hid_data(hid_data)
+                    self.scheduler.activity()
+                    success = await self.send_report(hid_data)
+                else:
+                    await self.send_settle()
                 '''
                 if success:
                     data_count += 1
@@ -560,8 +1210,12 @@ class RealHIDWebSocketReader:
                 if current_time - last_ping_time > 30:  # 30秒一次心跳
                     await self.send_ping()
                     last_ping_time = current_time
-                # 控制读取频率
-                await asyncio.sleep(self.polling_interval)
+                    if self.coalesced_reports:
+                        print(f"📦 已合并 {self.coalesced_reports} 条积压报告")
+                    if self.lever_suppressed:
+                        print(f"🎚️ 摇杆死区/滞回已过滤 {self.lever_suppressed} 条报告")
+                # 控制读取频率（按截止时间，不累积处理耗时）
+                await self.scheduler.wait()
 
             # 等待接收任务完成
             await receive_task
@@ -572,27 +1226,266 @@ class RealHIDWebSocketReader:
         finally:
             await self.cleanup()
 
+    async def run_thread_mode(self):
+        """thread模式：数据到达即发送，不再按 fre 定时轮询（多设备时每个设备一个线程）"""
+        report_queue = asyncio.Queue()
+        for device in self.devices:
+            device.start_reader_thread(asyncio.get_running_loop(), report_queue)
+        last_ping_time = time.time()
+
+        print("开始数据读取循环(thread)...")
+        while self.is_connected:
+            # 等待读取线程的数据，超时用于定期发送心跳
+            timeout = max(0.0, 30 - (time.time() - last_ping_time))
+            settle_at = [device.settle_at for device in self.devices if device.settle_at is not None]
+            if settle_at:
+                timeout = min(timeout, max(0.0, min(settle_at) - time.perf_counter()))
+            try:
+                device, hid_data = await asyncio.wait_for(report_queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                device, hid_data = None, None
+            if hid_data:
+                await self.send_report(hid_data, device)
+            for device in self.devices:
+                await self.send_settle(device)
+            # 定期发送心跳
+            current_time = time.time()
+            if current_time - last_ping_time > 30:  # 30秒一次心跳
+                await self.send_ping()
+                last_ping_time = current_time
+
+    async def run_input_mode(self):
+        """
+        yuangeki：鼠标/键盘监听有变化时才发送
+        鼠标停下 fre 秒后再发送一次相同状态，服务器据此显示手放下
+        """
+        last_ping_time = time.time()
+        last_sent = None
+        settle = False  # 摇杆移动后是否需要补发
+
+        print("开始数据读取循环(yuangeki)...")
+        while self.is_connected:
+            if settle:
+                timeout = self.polling_interval
+            else:
+                timeout = max(0.0, 30 - (time.time() - last_ping_time))
+            try:
+                await asyncio.wait_for(self.input_event.wait(), timeout=timeout)
+                self.input_event.clear()
+                timed_out = False
+            except asyncio.TimeoutError:
+                timed_out = True
+
+            state = (self.x, self.buttons)
+            if state != last_sent:
+                settle = last_sent is None or state[0] != last_sent[0]
+                last_sent = state
+                await self.send_hid_data({'x': state[0], 'buttons': state[1], 'DEVICE_NAME': DEVICE_NAME})
+            elif timed_out and settle:
+                settle = False
+                await self.send_hid_data({'x': state[0], 'buttons': state[1], 'DEVICE_NAME': DEVICE_NAME})
+
+            # 定期发送心跳
+            current_time = time.time()
+            if current_time - last_ping_time > 30:  # 30秒一次心跳
+                await self.send_ping()
+                last_ping_time = current_time
+
     async def cleanup(self):
         """清理资源"""
         print("🧹 清理资源...")
         self.is_connected = False
+        if self.watcher is not None:
+            self.watcher.stop()
+            reconnects = self.watcher.stats()
+            if reconnects:
+                print(f"🔌 重新连接 {reconnects['reconnects']} 次，"
+                      f"平均 {reconnects['avg_ms']:.0f}ms 最长 {reconnects['max_ms']:.0f}ms")
+            self.watcher = None
+        for device in self.devices:
+            device.stop_reader_thread()
+        if self.keyboard_hook is not None:
+            keyboard.unhook(self.keyboard_hook)
+            self.keyboard_hook = None
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        if self.coalesced_reports:
+            print(f"📦 共合并 {self.coalesced_reports} 条积压报告")
+        unchanged_reports = sum(device.unchanged_reports for device in self.devices)
+        if unchanged_reports:
+            print(f"🔇 共跳过 {unchanged_reports} 条没有变化的报告")
+        lever_suppressed = sum(device.lever_suppressed for device in self.devices)
+        if lever_suppressed:
+            print(f"🎚️ 摇杆死区/滞回共过滤 {lever_suppressed} 条报告")
+        if self.scheduler.late:
+            print(f"⏱️ 读取落后超过一个周期 {self.scheduler.late} 次")
 
         if hasattr(self, 'websocket'):
             await self.websocket.close()
 
-        self.cleanup_hid_device()
+        for device in self.devices:
+            device.cleanup_hid_device()
         print("✅ 资源清理完成")
 
 
+class InProcessHIDReader(RealHIDWebSocketReader):
+    """
+    在服务器进程内运行的读取器（见 button_printer/inprocess.py）
+    解析后的数据直接交给 ingest(device_id, data)，不经过 WebSocket
+    """
+
+    def __init__(self, ingest, vendor_id=VENDOR_ID, product_id=PRODUCT_ID):
+        super().__init__(vendor_id=vendor_id, product_id=product_id, websocket_url="inprocess")
+        self.ingest = ingest
+        if self.driver.decode:
+            # 事件循环由服务器共用，HID 设备只能在读取线程中阻塞读取
+            self.reader_mode = 'thread'
+
+    async def connect_to_websocket(self):
+        self.is_connected = True
+        print("✅ 进程内读取器：直接写入服务器状态")
+        return True
+
+    async def send_hid_data(self, unpacked_data, device=None):
+        device = device or self
+        try:
+            await self.ingest(device.device_id, unpacked_data)
+            return True
+        except Exception as e:
+            print(f"❌ 处理HID数据失败: {e}")
+            traceback.print_exc()
+            return False
+
+    async def receive_messages(self):
+        """没有服务器消息"""
+
+    async def send_ping(self):
+        """不需要心跳"""
+
+
+class DatagramHIDReader(RealHIDWebSocketReader):
+    """
+    同一台机器上部署时使用：每个 bin1 帧作为一个数据报发送到服务器的本地数据报入口
+    没有握手和回复，服务器还没启动时发送的帧直接丢失
+    """
+
+    def __init__(self, endpoint=ENDPOINT, vendor_id=VENDOR_ID, product_id=PRODUCT_ID):
+        super().__init__(vendor_id=vendor_id, product_id=product_id, websocket_url=endpoint)
+        self.endpoint = endpoint
+        self.sock = None
+        self.header = None  # DATAGRAM(generation)，每次连接时重新生成
+        self.send_errors = 0
+
+    async def connect_to_websocket(self):
+        try:
+            family, address = parse_endpoint(self.endpoint)
+            self.sock = socket.socket(family, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+            self.sock.connect(address)
+        except (OSError, ValueError) as e:
+            print(f"❌ 数据报入口连接失败: {e}")
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+            return False
+        self.header = DATAGRAM.pack(new_generation())
+        self.is_connected = True
+        self.use_binary = True
+        print(f"✅ 数据报入口: {self.endpoint}")
+        print(f"📦 数据格式: {WIRE_NAME}")
+        return True
+
+    async def send_hid_data(self, unpacked_data, device=None):
+        device = device or self
+        self.seq += 1
+        try:
+            self.sock.send(self.header + encode_frame(unpacked_data, device.device_slot, self.seq))
+            return True
+        except OSError as e:
+            # 服务器没有运行或接收缓冲区满，丢弃这一帧，之后的状态会覆盖它
+            if not self.send_errors:
+                print(f"⚠️ 数据报发送失败: {e}")
+            self.send_errors += 1
+            return False
+
+    async def receive_messages(self):
+        """没有服务器消息"""
+
+    async def send_ping(self):
+        """不需要心跳"""
+
+    async def cleanup(self):
+        await super().cleanup()
+        if self.send_errors:
+            print(f"⚠️ 共 {self.send_errors} 个数据报发送失败")
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class SharedStateHIDReader(DatagramHIDReader):
+    """
+    最新状态写入共享内存，再向数据报入口发送门铃唤醒服务器
+    服务器处理不过来时连续的报告合并，只读取最新的一个
+    """
+
+    def __init__(self, endpoint=ENDPOINT, segment_name=SEGMENT, vendor_id=VENDOR_ID, product_id=PRODUCT_ID):
+        super().__init__(endpoint, vendor_id=vendor_id, product_id=product_id)
+        self.segment_name = segment_name
+        self.segment = None
+        self.doorbells = []  # 每个槽位的门铃
+
+    async def connect_to_websocket(self):
+        # 先创建共享内存，失败时还没有打开门铃 socket
+        try:
+            self.segment = StateSegment.create(self.segment_name, len(self.devices))
+        except OSError as e:
+            print(f"❌ 共享内存创建失败: {e}")
+            return False
+        if not await super().connect_to_websocket():
+            self.segment.close()
+            self.segment = None
+            return False
+        self.doorbells = [DOORBELL.pack(self.segment.generation, device.device_slot) for device in self.devices]
+        print(f"🧠 共享内存: {self.segment_name}")
+        return True
+
+    async def send_hid_data(self, unpacked_data, device=None):
+        slot = (device or self).device_slot
+        self.seq += 1
+        self.segment.write(slot, encode_frame(unpacked_data, slot, self.seq))
+        try:
+            self.sock.send(self.doorbells[slot])
+            return True
+        except OSError as e:
+            # 状态已经写入，服务器下一次被唤醒时仍能读到
+            if not self.send_errors:
+                print(f"⚠️ 门铃发送失败: {e}")
+            self.send_errors += 1
+            return False
+
+    async def cleanup(self):
+        await super().cleanup()
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+
 async def main():
     """主函数"""
 
     # 创建读取器实例
-    reader = RealHIDWebSocketReader(
-        vendor_id=VENDOR_ID,
-        product_id=PRODUCT_ID,
-        websocket_url="ws://127.0.0.1:8000/ws/hid/"
-    )
+    if TRANSPORT == 'shared_memory':
+        reader = SharedStateHIDReader(ENDPOINT, SEGMENT, vendor_id=VENDOR_ID, product_id=PRODUCT_ID)
+    elif TRANSPORT == 'datagram':
+        reader = DatagramHIDReader(ENDPOINT, vendor_id=VENDOR_ID, product_id=PRODUCT_ID)
+    else:
+        reader = RealHIDWebSocketReader(
+            vendor_id=VENDOR_ID,
+            product_id=PRODUCT_ID,
+            websocket_url="ws://127.0.0.1:8000/ws/hid/"
+        )
 
     await reader.run()
 
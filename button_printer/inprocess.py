@@ -0,0 +1,65 @@
+# button_printer/inprocess.py
+"""
+进程内 HID 读取器（settings.HID_INPROCESS_READER = True）
+
+读取器作为 Daphne 事件循环中的任务运行，解析后的数据直接交给 consumers.ingest_hid_data，
+不再经过 WebSocket、JSON 和单独的 hid_reader 进程。
+HID 设备的阻塞读取在读取线程中进行（thread 模式），不会阻塞事件循环。
+
+启动时机:
+    支持 ASGI lifespan 的服务器（uvicorn 等）在启动时由 asgi.py 的 lifespan 启动；
+    Daphne 不发送 lifespan 事件，由第一个连接的页面启动。
+"""
+import asyncio
+
+_reader = None
+_reader_task = None
+
+
+def ensure_reader_started():
+    """
+    读取器没有运行时在当前事件循环中启动（可以重复调用）
+    设备打开失败时读取器任务结束，下一次调用会重试
+    """
+    global _reader, _reader_task
+    if _reader_task is not None and not _reader_task.done():
+        return
+    try:
+        from .consumers import ingest_hid_data
+        from .hid_reader import InProcessHIDReader
+        _reader = InProcessHIDReader(ingest_hid_data)
+    except (Exception, SystemExit) as e:
+        # hid_reader 读取 config.ini 或加载 hidapi 失败时会 sys.exit()
+        print(f"❌ 进程内读取器启动失败: {e}")
+        _reader_task = None
+        return
+    _reader_task = asyncio.get_running_loop().create_task(_reader.run())
+    print("🚀 进程内读取器已启动")
+
+
+async def stop_reader():
+    """停止读取器并等待清理完成"""
+    global _reader, _reader_task
+    task = _reader_task
+    _reader_task = None
+    _reader = None
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def reader_status():
+    """系统状态中显示的读取器信息"""
+    if _reader is None or _reader_task is None or _reader_task.done():
+        return {'running': False}
+    return {
+        'running': True,
+        'device_id': _reader.device_id,
+        'mode': _reader.reader_mode,
+        'unchanged_reports': _reader.unchanged_reports,
+        'lever_suppressed': _reader.lever_suppressed,
+    }
@@ -0,0 +1,134 @@
+# button_printer/lever.py
+"""
+摇杆分区查找表
+
+摇杆位置 -> 分区图片（lever_N），子位置 -> 0 ~ sub_zones-1。
+每个设备的标定（L_MAX、R_MAX、分区数）只在第一次使用时计算一次：
+8 位摇杆（ontroller、nageki、simgeki）直接用数组下标查表，
+io4 的 int16 范围和超出表范围的值（yuangeki 鼠标坐标）用 bisect 在分界值上查找。
+
+不依赖 Django，hid_reader 也可以直接使用。
+"""
+import math
+from bisect import bisect_left, bisect_right
+
+INT16_MIN = -32768
+INT16_MAX = 32767
+# 8 位摇杆的查表范围（N_FLAG=1 时位置取反，所以包含负数）
+BYTE_MIN = -255
+BYTE_MAX = 255
+
+# 子位置使用 int16 范围的设备，其它设备为 0 ~ 255
+INT16_SUB_DEVICES = ('io4',)
+# 摇杆位置为 8 位的设备，分区直接查表
+BYTE_LEVER_DEVICES = ('ontroller', 'nageki', 'simgeki')
+
+
+def lever_labels(zones):
+    """分区编号，从左到右；5 个分区为 -2 -1 0 1 2"""
+    return [i - zones // 2 for i in range(zones)]
+
+
+def lever_keys(zones):
+    """所有分区的图片 key"""
+    return ['lever_' + str(label) for label in lever_labels(zones)]
+
+
+class StepLookup:
+    """
+    单调阶梯函数: values[bisect_right(thresholds, v)]
+    给出 table_range 时在该范围内预先展开为数组，整数直接下标查找
+    """
+
+    def __init__(self, thresholds, values, table_range=None):
+        self.thresholds = list(thresholds)
+        self.values = list(values)
+        if table_range is None:
+            self.base = 0
+            self.table = []
+        else:
+            low, high = table_range
+            self.base = low
+            self.table = [self.values[bisect_right(self.thresholds, v)] for v in range(low, high + 1)]
+
+    def __call__(self, value):
+        index = value - self.base
+        # 浮点数（yuangeki 的初始位置、JSON 中的小数）不能作下标，用 bisect 查找
+        if type(index) is int and 0 <= index < len(self.table):
+            return self.table[index]
+        return self.values[bisect_right(self.thresholds, value)]
+
+
+def zone_boundaries(l_max, r_max, zones):
+    """
+    分区分界值，从大到小 [L_MAX L(zones-1)) ... [R(1) R_MAX]
+    5 个分区时与原来的 L_2 L_1 R_1 R_2 相同
+    """
+    if l_max < r_max:
+        l_max, r_max = r_max, l_max
+    space = math.ceil((l_max - r_max) / zones)
+    return [l_max - space * i for i in range(1, zones)]
+
+
+def sub_thresholds(sub_zones, int16):
+    """子位置的分界值：第 k 个值是子位置 >= k 的最小输入"""
+    if int16:
+        low, high = INT16_MIN, INT16_MAX
+        sub_range_size = (INT16_MAX - INT16_MIN + 1) / sub_zones
+
+        def sub_position(value):
+            return min(max(int((value - INT16_MIN) // sub_range_size), 0), sub_zones - 1)
+    else:
+        low, high = 0, BYTE_MAX
+        sub_range_size = BYTE_MAX / sub_zones
+
+        def sub_position(value):
+            return min(max(int(value // sub_range_size), 0), sub_zones - 1)
+
+    values = range(low, high + 1)
+    return [values[bisect_left(values, k, key=sub_position)] for k in range(1, sub_zones)]
+
+
+class LeverCalibration:
+    """
+    一个设备的摇杆标定
+
+    参数:
+        device_name: 设备名
+        l_max, r_max: 摇杆左右极限（config.ini [boundary]）
+        n_flag: 1 时摇杆方向取反（yuangeki 总是取反）
+        zones: 摇杆分区数，图片为 lever_-(zones//2) ... lever_(zones-1-zones//2)
+        sub_zones: 子位置数
+    """
+
+    def __init__(self, device_name, l_max, r_max, n_flag=0, zones=5, sub_zones=20):
+        if zones < 1 or sub_zones < 1:
+            raise ValueError(f'摇杆分区数错误: zones={zones} sub_zones={sub_zones}')
+        if n_flag == 1 or device_name == 'yuangeki':
+            l_max = -abs(l_max)
+            r_max = -abs(r_max)
+        self.device_name = device_name
+        self.zones = zones
+        self.sub_zones = sub_zones
+        self.keys = lever_keys(zones)
+
+        # 位置越大越靠左，bisect 需要升序的分界值
+        boundaries = zone_boundaries(l_max, r_max, zones)
+        table_range = (BYTE_MIN, BYTE_MAX) if device_name in BYTE_LEVER_DEVICES else None
+        self.zone_key = StepLookup(reversed(boundaries), reversed(self.keys), table_range)
+
+        int16 = device_name in INT16_SUB_DEVICES
+        table_range = None if int16 else (BYTE_MIN, BYTE_MAX)
+        self.sub_position = StepLookup(sub_thresholds(sub_zones, int16), range(sub_zones), table_range)
+
+    @classmethod
+    def from_config(cls, config, device_name):
+        """从 config.ini 的 [boundary] 读取标定"""
+        return cls(
+            device_name,
+            int(config.get('boundary', 'L_MAX')),
+            int(config.get('boundary', 'R_MAX')),
+            int(config.get('boundary', 'N_FLAG')),
+            int(config.get('boundary', 'zones', fallback='5')),
+            int(config.get('boundary', 'sub_zones', fallback='20')),
+        )
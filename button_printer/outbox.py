@@ -0,0 +1,116 @@
+# button_printer/outbox.py
+"""
+每个连接的有界发送队列
+
+广播只把消息放进队列，由每个连接自己的发送任务写入 socket，
+一个卡住的页面不会拖慢其它连接。队列满时待发送的显示更新会合并成最新状态。
+页面只收到显示差异，显示更新不会被丢弃；合并后仍然放不下时丢弃最早的其它消息。
+"""
+import asyncio
+from collections import deque
+
+
+class ClientOutbox:
+    """
+    参数:
+        send: 发送函数 async send(message)，message 含 'text' 或 'bytes'
+        encode_display: 把合并后的事件列表重新编码为 message 的函数
+        decode_display: 把 ids1 帧还原为事件列表的函数（只在合并时调用）
+        maxsize: 队列长度上限
+    """
+
+    def __init__(self, send, encode_display, decode_display=None, maxsize=64):
+        self.send = send
+        self.encode_display = encode_display
+        self.decode_display = decode_display
+        self.maxsize = maxsize
+        self.pending = deque()  # (message, display)，display 为 None 表示不可合并的消息
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+        # 统计
+        self.dropped = 0  # 合并后仍然放不下而丢弃的（非显示更新）消息数
+        self.collapsed = 0  # 被合并掉的显示更新数
+
+    def start(self):
+        """启动发送任务"""
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """停止发送任务，未发送的消息直接丢弃"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        self.pending.clear()
+
+    def put(self, message, display=None):
+        """
+        放入一条待发送消息（不等待）
+
+        参数:
+            message: 已编码的消息
+            display: 显示更新的事件列表或 ids1 帧（bytes），队列满时可以与其它显示更新合并
+        """
+        self.pending.append((message, display))
+        if len(self.pending) > self.maxsize:
+            self.collapse()
+            while len(self.pending) > self.maxsize and self.drop_oldest():
+                pass
+        self.wakeup.set()
+
+    def collapse(self):
+        """把队列中所有显示更新合并为一条最新状态，放在第一条显示更新的位置"""
+        final = {}
+        kept = deque()
+        first = None  # 合并后的显示更新在 kept 中的位置
+        count = 0
+        for message, display in self.pending:
+            if display is None:
+                kept.append((message, display))
+                continue
+            count += 1
+            # channel layer 广播只带编码好的帧，合并时才还原事件列表
+            events = self.decode_display(display) if isinstance(display, bytes) else display
+            for event in events:
+                final[event['key']] = event['visible']
+            if first is None:
+                first = len(kept)
+                kept.append(None)
+        if count < 2:
+            return
+        events = [{'key': key, 'visible': visible} for key, visible in final.items()]
+        kept[first] = (self.encode_display(events), events)
+        self.pending = kept
+        self.collapsed += count - 1
+
+    def drop_oldest(self):
+        """丢弃最早的非显示消息，没有可以丢弃的消息时返回 False"""
+        for index, (message, display) in enumerate(self.pending):
+            if display is None:
+                del self.pending[index]
+                self.dropped += 1
+                return True
+        return False
+
+    def stats(self):
+        return {
+            'queued': len(self.pending),
+            'dropped': self.dropped,
+            'collapsed': self.collapsed,
+        }
+
+    async def run(self):
+        """发送任务：按顺序把队列中的消息写入 socket"""
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending:
+                message, _ = self.pending.popleft()
+                try:
+                    await self.send(message)
+                except Exception as e:
+                    print(f"❌ 发送失败: {e}")
@@ -3,6 +3,8 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/hid/$', consumers.HIDConsumer.as_asgi()),
+    # 只显示一个设备的页面（多设备 hid_reader 时每个设备一个页面）
+    re_path(r'ws/hid/(?P<device_id>[-a-zA-Z0-9_]+)/$', consumers.HIDConsumer.as_asgi()),
 ]
 
 print("✅ WebSocket 路由已加载")
\ No newline at end of file
@@ -1,9 +1,11 @@
 # button_printer/services.py
 import configparser
-import math
 import os
 import sys
-import keyboard
+from functools import lru_cache
+
+from .hid_protocol import DISPLAY_MAX_IMAGES
+from .lever import LeverCalibration, lever_keys
 
 OUTPUT_T_FORMAT = '<8h 4h 2B 2B 2H 2B 29x'  # 小端字节序，2B 2B 表示 2个 coin_data_t（每个2字节）
 
@@ -32,22 +34,6 @@ key_map_io4 = {
         9: RW  # 右侧
     }
 }
-key_map_sim = {
-    # 索引0
-    0: {
-        6: LR,
-        5: LG,
-        4: LB,
-        1: RR,
-        0: RG,
-        3: RW
-    },
-    # 索引1
-    1: {
-        6: LW,
-        7: RB,
-    }
-}
 key_map_o = {
     7: LR,
     6: LG,
@@ -80,20 +66,77 @@ key_map_na = {
 
 }
 
-# 键盘对应HID表
-HID2KM = {
-    '31': "s",
-    '0': "d",
-    '5': "f",
-    '4': "g",
-    '1': "h",
-    '16': "j",
-    '15': "k",
-    '14': "l",
+# 按下掩码：第 i 位对应 BUTTON_KEYS[i]，低4位为左侧
+BUTTON_KEYS = (LW, LR, LG, LB, RR, RG, RB, RW)
+BUTTON_BITS = {key: 1 << i for i, key in enumerate(BUTTON_KEYS)}
+LEFT_MASK = 0x0F
+RIGHT_MASK = 0xF0
+# 按下/释放的处理顺序
+PROCESS_ORDER = tuple((key, key + "m", BUTTON_BITS[key]) for key in (LW, LR, LG, LB, RR, RG, RW, RB))
+
+
+def build_key_table(key_map, length):
+    """key 按位值（第 i 个字符为 '1' 时置位 bit i）到按下掩码的查找表"""
+    table = []
+    for bits in range(1 << length):
+        mask = 0
+        for index, key in key_map.items():
+            if bits >> index & 1:
+                mask |= BUTTON_BITS[key]
+        table.append(mask)
+    return table
+
+
+def build_switch_tables(word_map):
+    """
+    io4 开关字到按下掩码的查找表，低字节、高字节各一张
+    key_map_io4 中的下标是 f"{s:016b}" 的字符下标，对应 bit = 15 - 下标
+    """
+    low = [0] * 256
+    high = [0] * 256
+    for value in range(256):
+        for index, key in word_map.items():
+            bit = 15 - index
+            if bit < 8 and value >> bit & 1:
+                low[value] |= BUTTON_BITS[key]
+            if bit >= 8 and value >> (bit - 8) & 1:
+                high[value] |= BUTTON_BITS[key]
+    return low, high
+
+
+IO4_SWITCH_TABLES = (build_switch_tables(key_map_io4[0]), build_switch_tables(key_map_io4[1]))
+IO4_INVERTED = (0, 1 << (15 - 9))  # 右侧 RW 松开时为 1，先取反
+KEY_TABLES = {
+    'ontroller': build_key_table(key_map_o, 8),
+    'ontroller_idk': build_key_table(key_map_o_idk, 8),
+    'nageki': build_key_table(key_map_na, 10),
 }
-key_states = {key: False for key in [LW, LR, LG, LB, RR, RG, RB, RW]}
+
+
+def switch_word(switch):
+    """simgeki 通过 JSON 发送的开关为 '0b...' 字符串"""
+    if isinstance(switch, str):
+        return int(switch, 2)
+    return switch
+
+
+def key_bits(hid_data):
+    """key 按位值，二进制帧直接给出 key_bits，JSON 中为 '0101...' 字符串"""
+    bits = hid_data.get('key_bits')
+    if bits is None:
+        key = hid_data.get('key', '')
+        try:
+            bits = int(key[::-1], 2)
+        except ValueError:
+            bits = 0
+            for i, char in enumerate(key):
+                if char == '1':
+                    bits |= 1 << i
+    return bits
+
 
 config = configparser.ConfigParser()
+LEVER_ZONES = 5
 
 
 def get_config_path():
@@ -115,344 +158,177 @@ try:
     config_path = get_config_path()
     print(f"config_path                {config_path}")
     config.read(config_path)
-    L_MAX = int(config.get('boundary', 'L_MAX'))
-    R_MAX = int(config.get('boundary', 'R_MAX'))
-    N_FLAG = int(config.get('boundary', 'N_FLAG'))
-    # 摇杆边界值设定 [L_MAX L2] [L2 L1] [L1 R1] [R1 R2] [R2 R_MAX]
-    if N_FLAG == 1 or config.get('device', 'device_name') == 'yuangeki':
-        L_MAX = -abs(L_MAX)
-        R_MAX = -abs(R_MAX)
-    if L_MAX < R_MAX:
-        temp = L_MAX
-        L_MAX = R_MAX
-        R_MAX = temp
-    space = math.ceil((L_MAX - R_MAX) / 5)
-    L_2 = L_MAX - space
-    L_1 = L_2 - space
-    R_1 = L_1 - space
-    R_2 = R_1 - space
+    # 摇杆分区数，每个分区对应一张 lever_N 图片
+    LEVER_ZONES = int(config.get('boundary', 'zones', fallback='5'))
 except configparser.Error as e:
     print(e)
     print("fail to read config.ini")
 
+LEVER_KEYS = tuple(lever_keys(LEVER_ZONES))
+lever_calibrations = {}  # device_name -> LeverCalibration
+
+
+def get_lever_calibration(device_name):
+    """设备的摇杆标定，第一次使用时按 config.ini 计算查找表"""
+    calibration = lever_calibrations.get(device_name)
+    if calibration is None:
+        calibration = lever_calibrations[device_name] = LeverCalibration.from_config(config, device_name)
+    return calibration
+
+
+# 所有图片的 key（与 insert_buttons.py 一致）
+IMAGE_KEYS = (
+    LW, LW + "m", LR, LR + "m", LG, LG + "m", LB, LB + "m",
+    RR, RR + "m", RG, RG + "m", RB, RB + "m", RW, RW + "m",
+    *("l_" + key for key in LEVER_KEYS),
+    *("r_" + key for key in LEVER_KEYS),
+    *LEVER_KEYS,
+    'bg_swing', 'l_0', 'r_0',
+)
+# 图片 id：IMAGE_KEYS 中的下标，页面通过 index 页面中的 IMAGE_MANIFEST 得到同样的对应关系
+IMAGE_IDS = {key: image_id for image_id, key in enumerate(IMAGE_KEYS)}
+if len(IMAGE_KEYS) > DISPLAY_MAX_IMAGES:
+    # ids1 显示更新中 image_id 只有 1 字节，超出后每次广播都会编码失败
+    raise ValueError(f'图片数 {len(IMAGE_KEYS)} 超过 {DISPLAY_MAX_IMAGES}，请减少 config.ini [boundary] zones')
+
+
+# 预先生成的显示/隐藏事件，处理报告时不再拼接字符串、创建字典（事件在报告间共享，不能修改）
+SHOW = {key: {'key': key, 'visible': True} for key in IMAGE_KEYS}
+HIDE = {key: {'key': key, 'visible': False} for key in IMAGE_KEYS}
+MOTION_KEYS = {key: key + "m" for key in BUTTON_KEYS}  # 按键 -> 手部动作图片
+LEVER_HIDE = tuple(HIDE[key] for key in LEVER_KEYS)  # 隐藏所有摇杆图片
+HIDE_LEFT_HAND = {key: HIDE["l_" + key] for key in LEVER_KEYS}  # 摇杆图片 -> 隐藏左手握摇杆
+HIDE_RIGHT_HAND = {key: HIDE["r_" + key] for key in LEVER_KEYS}  # 摇杆图片 -> 隐藏右手握摇杆
+
+# 摇杆移动时左右手的显示
+# (左侧有按键, 右侧有按键, is_left): (事件, is_show_bg_l0, is_show_bg_r0, is_left)
+# 事件中的 {} 为摇杆位置的图片 lever_N
+HAND_CASES = {
+    # 情况1 左右两侧都有按键：只显示摇杆
+    (True, True, True): ((("l_{}", False), ("r_{}", False), ("{}", True)), False, False, True),
+    (True, True, False): ((("l_{}", False), ("r_{}", False), ("{}", True)), False, False, False),
+    # 情况2 左侧有 右侧没有：右手握摇杆
+    (True, False, True): ((("bg_swing", False), ("{}", False), ("l_{}", True), ("r_{}", False)), True, False, False),
+    (True, False, False): ((("bg_swing", False), ("{}", False), ("l_{}", True), ("r_{}", False)), True, False, False),
+    # 情况3 右侧有 左侧没有：左手握摇杆
+    (False, True, True): ((("bg_swing", False), ("{}", False), ("l_{}", False), ("r_{}", True)), False, True, True),
+    (False, True, False): ((("bg_swing", False), ("{}", False), ("l_{}", False), ("r_{}", True)), False, True, True),
+    # 情况4 都没有：沿用上一次握摇杆的手
+    (False, False, True): ((("bg_swing", False), ("{}", False), ("r_{}", True)), False, True, True),
+    (False, False, False): ((("bg_swing", False), ("{}", False), ("l_{}", True)), True, False, False),
+}
+# 摇杆图片 -> {情况: (事件, is_show_bg_l0, is_show_bg_r0, is_left)}
+HAND_EVENTS = {
+    pos_image: {
+        case: (tuple((SHOW if visible else HIDE)[key.format(pos_image)] for key, visible in template), *flags)
+        for case, (template, *flags) in HAND_CASES.items()
+    }
+    for pos_image in LEVER_KEYS
+}
 
-def close_swing(events):
-    lever_str = {"lever_0", "lever_1", "lever_-1", "lever_2", "lever_-2"}
-    for i in lever_str:
-        events.append({'key': i, 'visible': False, })
-    return events
-
-
-def show_lever_KM(x, events, device_name):
-    result = []
-    # 显示摇杆
-    position = x  # 摇杆位置
-    pos_image = HIDService.get_pos(position)  # 摇杆位置的图片
-    sub_pos = HIDService.get_sub_position(x, device_name)
-    # print("---------------------------------------------")
-    # print(position)
-    is_l_buttons = False
-    is_r_buttons = False
-    release_button_i = 0
-    # print(LW)
-    for i in (LW, LR, LG, LB, RR, RG, RB, RW):
-        if release_button_i < 4:  # 左侧
-            if HIDService.release_button[i] == 1:
-                is_l_buttons = True
-        else:
-            if HIDService.release_button[i] == 1:
-                # print("右侧有键")
-                is_r_buttons = True
-        release_button_i = release_button_i + 1
-    last_lever_pos = HIDService.last_lever_pos
-    if HIDService.last_lever_pos != position:  # 左侧有按键则不显示摇杆 右侧同
-        events = close_swing(events)
-        if HIDService.last_lever_pos != "":
-            events.append({'key': "l_" + str(HIDService.get_pos(HIDService.last_lever_pos)), 'visible': False, })
-            events.append({'key': "r_" + str(HIDService.get_pos(HIDService.last_lever_pos)), 'visible': False, })
-        # print(f"{is_l_buttons}  {is_r_buttons}")
-        if HIDService.last_button != "":
-            events.append({'key': HIDService.last_button, 'visible': False, })
-        if is_l_buttons and is_r_buttons:  # 情况1 左右两侧都有按键
-            # print("情况1")
-            events.append({'key': "l_" + pos_image, 'visible': False, })
-            events.append({'key': "r_" + pos_image, 'visible': False, })
-            events.append({'key': pos_image, 'visible': True, })
-        else:
-            events.append({'key': "bg_swing", 'visible': False, })
-        if is_l_buttons and not is_r_buttons:  # 情况2 左侧有 右侧没有
-            # print("情况2")
-            # print("l_" + pos_image)
-            HIDService.is_show_bg_l0 = True
-            HIDService.is_left = False
-            events.append({'key': pos_image, 'visible': False, })
-            events.append({'key': "l_" + pos_image, 'visible': True, })
-            events.append({'key': "r_" + pos_image, 'visible': False, })
-        else:
-            HIDService.is_show_bg_l0 = False
-        if not is_l_buttons and is_r_buttons:  # 情况3 右侧有 左侧没有
-            # print("情况3")
-            HIDService.is_show_bg_r0 = True
-            HIDService.is_left = True
-            events.append({'key': pos_image, 'visible': False, })
-            events.append({'key': "l_" + pos_image, 'visible': False, })
-            events.append({'key': "r_" + pos_image, 'visible': True, })
-
-        else:
-            HIDService.is_show_bg_r0 = False
-        if not is_l_buttons and not is_r_buttons:  # 情况4 都没有
-            # print("情况4")
-            # print(self.is_left)
-            if HIDService.is_left:
-                # print("换右")
-                HIDService.is_show_bg_r0 = True
-                events.append({'key': pos_image, 'visible': False, })
-                events.append({'key': "r_" + pos_image, 'visible': True, })  # 换默认右
-            else:
-                # print("换左")
-                HIDService.is_show_bg_l0 = True
-                events.append({'key': pos_image, 'visible': False, })
-                events.append({'key': "l_" + pos_image, 'visible': True, })  # 换默认左
-        HIDService.last_lever_pos = position
-    elif HIDService.last_lever_pos == position:  # 摇杆不动 手放下
-        if HIDService.last_subpos == sub_pos:
-            # self.bg_item_swing.setVisible(True)
-            events.append({'key': pos_image, 'visible': True, })
-            HIDService.is_show_bg_r0 = True
-            HIDService.is_show_bg_l0 = True
-            events.append({'key': "l_" + str(HIDService.get_pos(HIDService.last_lever_pos)), 'visible': False, })
-            events.append({'key': "r_" + str(HIDService.get_pos(HIDService.last_lever_pos)), 'visible': False, })
-        HIDService.last_subpos = sub_pos
-    result.append(last_lever_pos)
-    result.append(events)
-    return result
-
-
-def show_lever(data_hid, key_data, pressed_keys, events, device_name):
-    result = []
-    # 显示摇杆
-    if device_name in ("io4", "simgeki"):
-        position = data_hid.get('rotary')[1]
-        pos_image = HIDService.get_pos(position)
-        sub_pos = HIDService.get_sub_position(data_hid.get('rotary')[0], device_name)
-        key_map = key_map_io4
-        # print(sub_pos)
-    else:
-        # 显示摇杆
-        if device_name == "nageki":
-            key_map = key_map_na
-        if device_name == "ontroller":
-            if int(data_hid.get("idk")) == 0:
-                key_map = key_map_o
-            else:
-                key_map = key_map_o_idk
-
-        position = data_hid.get("pos")  # 摇杆位置
-        pos_image = HIDService.get_pos(position)
-        sub_pos = HIDService.get_sub_position(data_hid.get("sub_pos"), device_name)
-        # print(sub_pos)
-
-    is_l_buttons = False
-    is_r_buttons = False
-    release_button_i = 0
-    for i in (LW, LR, LG, LB, RR, RG, RB, RW):
-        if release_button_i < 4:  # 左侧
-            if HIDService.release_button[i] == 1:
-                is_l_buttons = True
-        else:
-            if HIDService.release_button[i] == 1:
-                # print("右侧有键")
-                is_r_buttons = True
-        release_button_i = release_button_i + 1
-    last_lever_pos = HIDService.last_lever_pos
-    if HIDService.last_lever_pos != position:  # 左侧有按键则不显示摇杆 右侧同
-        events = close_swing(events)
-        if HIDService.last_lever_pos != "":
-            events.append({'key': "l_" + str(HIDService.get_pos(HIDService.last_lever_pos)), 'visible': False, })
-            events.append({'key': "r_" + str(HIDService.get_pos(HIDService.last_lever_pos)), 'visible': False, })
-        # print(f"{is_l_buttons}  {is_r_buttons}")
-        if HIDService.last_button != "":
-            events.append({'key': HIDService.last_button, 'visible': False, })
-        if is_l_buttons and is_r_buttons:  # 情况1 左右两侧都有按键
-            # print("情况1")
-            events.append({'key': "l_" + pos_image, 'visible': False, })
-            events.append({'key': "r_" + pos_image, 'visible': False, })
-            events.append({'key': pos_image, 'visible': True, })
-        else:
-            events.append({'key': "bg_swing", 'visible': False, })
-        if is_l_buttons and not is_r_buttons:  # 情况2 左侧有 右侧没有
-            # print("情况2")
-            # print("l_" + pos_image)
-            HIDService.is_show_bg_l0 = True
-            HIDService.is_left = False
-            events.append({'key': pos_image, 'visible': False, })
-            events.append({'key': "l_" + pos_image, 'visible': True, })
-            events.append({'key': "r_" + pos_image, 'visible': False, })
-        else:
-            HIDService.is_show_bg_l0 = False
-        if not is_l_buttons and is_r_buttons:  # 情况3 右侧有 左侧没有
-            # print("情况3")
-            HIDService.is_show_bg_r0 = True
-            HIDService.is_left = True
-            events.append({'key': pos_image, 'visible': False, })
-            events.append({'key': "l_" + pos_image, 'visible': False, })
-            events.append({'key': "r_" + pos_image, 'visible': True, })
-
-        else:
-            HIDService.is_show_bg_r0 = False
-        if not is_l_buttons and not is_r_buttons:  # 情况4 都没有
-            # print("情况4")
-            # print(self.is_left)
-            if HIDService.is_left:
-                # print("换右")
-                HIDService.is_show_bg_r0 = True
-                events.append({'key': pos_image, 'visible': False, })
-                events.append({'key': "r_" + pos_image, 'visible': True, })  # 换默认右
-            else:
-                # print("换左")
-                HIDService.is_show_bg_l0 = True
-                events.append({'key': pos_image, 'visible': False, })
-                events.append({'key': "l_" + pos_image, 'visible': True, })  # 换默认左
-        HIDService.last_lever_pos = position
-    elif HIDService.last_lever_pos == position:  # 摇杆不动 手放下
-        if HIDService.last_subpos == sub_pos:
-            # self.bg_item_swing.setVisible(True)
-            events.append({'key': pos_image, 'visible': True, })
-            HIDService.is_show_bg_r0 = True
-            HIDService.is_show_bg_l0 = True
-            events.append({'key': "l_" + str(HIDService.get_pos(HIDService.last_lever_pos)), 'visible': False, })
-            events.append({'key': "r_" + str(HIDService.get_pos(HIDService.last_lever_pos)), 'visible': False, })
-        HIDService.last_subpos = sub_pos
-    # print("l_" + pos_image)
-    if device_name in ("io4", "simgeki"):
-
-        for switch_idx in range(2):  # 遍历左/右开关
-            for bit_pos in range(16):  # 检查每一位
-                new_state = int(key_data[switch_idx][bit_pos])  # 注意：bits[0]是MSB（Bit15）
-                if switch_idx == 1 and bit_pos == 9:  # 特殊处理RW
-                    if new_state == 0:
-                        new_state = 1
-                    else:
-                        new_state = 0
-                if new_state == 1:
-                    if switch_idx == 0:
-                        key_map_l = key_map.get(switch_idx)
-                        for i in key_map_l.keys():
-                            if bit_pos == i:
-                                pressed_keys.append(key_map_l.get(i))
-                    else:
-                        key_map_r = key_map.get(switch_idx)
-                        for i in key_map_r.keys():
-                            if bit_pos == i:
-                                pressed_keys.append(key_map_r.get(i))
-        if data_hid.get('system_status', 0) == 0:
-            pressed_keys.append(LW)
-
-    elif device_name == "simgeki2":
-        key_data_list = [list(s) for s in key_data]
-        for switch_idx in range(2):  # 遍历左/右开关
-            for bit_pos in range(8):  # 检查每一位
-                new_state = int(key_data_list[switch_idx][bit_pos])  # 注意：bits[0]是MSB（Bit15）
-                if (switch_idx == 0 and bit_pos == 3) or (switch_idx == 1 and bit_pos == 6):  # 特殊处理RW LW
-                    if new_state == 0:
-                        new_state = 1
-                    else:
-                        new_state = 0
-                if new_state == 1:
-                    if switch_idx == 0:
-                        key_map_l = key_map.get(switch_idx)
-                        for i in key_map_l.keys():
-                            if bit_pos == i:
-                                pressed_keys.append(key_map_l.get(i))
-                    else:
-                        key_map_r = key_map.get(switch_idx)
-                        for i in key_map_r.keys():
-                            if bit_pos == i:
-                                pressed_keys.append(key_map_r.get(i))
 
-    else:
-        for bit_pos in range(len(key_data)):  # 检查每一位
-            new_state = int(key_data[bit_pos])
-            if new_state == 1:
-                for i in key_map.keys():
-                    if bit_pos == i:
-                        print(i)
-                        pressed_keys.append(key_map.get(i))
-    result.append(pressed_keys)
-    result.append(last_lever_pos)
-    result.append(events)
-    return result
-
-
-def m_press(pressed_key, pressed_key_motion, diff1, diff2, last_lever_pos, ):
-    HIDService.release_button[pressed_key] = 1
+def show_lever(session, position, pos_image, sub_pos, events):
+    """
+    显示摇杆
+
+    参数:
+        position: 摇杆位置
+        pos_image: 摇杆位置的图片（lever_N）
+        sub_pos: 子位置，与上一次相同表示摇杆不动
+    """
+    last_lever_pos = session.last_lever_pos
+    if last_lever_pos != position:  # 左侧有按键则不显示摇杆 右侧同
+        events.extend(LEVER_HIDE)
+        if last_lever_pos != "":
+            events.append(HIDE_LEFT_HAND[session.last_pos_image])
+            events.append(HIDE_RIGHT_HAND[session.last_pos_image])
+        if session.last_button != "":
+            events.append(HIDE[session.last_button])
+        case = (bool(session.pressed & LEFT_MASK), bool(session.pressed & RIGHT_MASK), session.is_left)
+        hand_events, session.is_show_bg_l0, session.is_show_bg_r0, session.is_left = HAND_EVENTS[pos_image][case]
+        events.extend(hand_events)
+        session.last_lever_pos = position
+        session.last_pos_image = pos_image
+    else:  # 摇杆不动 手放下
+        if session.last_subpos == sub_pos:
+            events.append(SHOW[pos_image])
+            session.is_show_bg_r0 = True
+            session.is_show_bg_l0 = True
+            events.append(HIDE_LEFT_HAND[session.last_pos_image])
+            events.append(HIDE_RIGHT_HAND[session.last_pos_image])
+        session.last_subpos = sub_pos
+    return [last_lever_pos, events]
+
+
+def m_press(session, pressed_key, pressed_key_motion, diff1, diff2, last_lever_pos, ):
+    session.pressed |= BUTTON_BITS[pressed_key]
     events = []
     if pressed_key in (LW, LR, LG, LB):
-        if last_lever_pos != HIDService.last_lever_pos:
-            events.append(HIDService.crete_event("r_" + str(HIDService.get_pos(HIDService.last_lever_pos)), False))
-        events.append(HIDService.crete_event("l_0", False))
+        if last_lever_pos != session.last_lever_pos:
+            events.append(HIDE_RIGHT_HAND[session.last_pos_image])
+        events.append(HIDE["l_0"])
 
     else:
-        if last_lever_pos != HIDService.last_lever_pos:
-            events.append(HIDService.crete_event("l_" + str(HIDService.get_pos(HIDService.last_lever_pos)), False))
-        events.append(HIDService.crete_event("r_0", False))
+        if last_lever_pos != session.last_lever_pos:
+            events.append(HIDE_LEFT_HAND[session.last_pos_image])
+        events.append(HIDE["r_0"])
 
     if pressed_key in (LW, LR, LG, LB, RR, RG, RB, RW):
         # print(f"press = {pressed_key}")
         # print(f"release = {released_key}")
-        events.append(HIDService.crete_event(pressed_key, True))
-        events.append(HIDService.crete_event(pressed_key_motion, True))
+        events.append(SHOW[pressed_key])
+        events.append(SHOW[pressed_key_motion])
         # print(f"{pressed_key} 显示")
 
         # 动作图片隐藏的逻辑判断
         if pressed_key in (LW, LR, LG, LB):
-            HIDService.left_show = pressed_key_motion
-            for le in reversed(range(len(HIDService.last_left_button_arr))):
-                if HIDService.last_left_button_arr[le] != "":
-                    events.append(HIDService.crete_event(HIDService.last_left_button_arr[le] + "m", False))
+            session.left_show = pressed_key_motion
+            for le in reversed(range(len(session.last_left_button_arr))):
+                if session.last_left_button_arr[le] != "":
+                    events.append(HIDE[MOTION_KEYS[session.last_left_button_arr[le]]])
         else:
-            HIDService.right_show = pressed_key_motion
-            for r in reversed(range(len(HIDService.last_right_button_arr))):
-                if HIDService.last_right_button_arr[r] != "":
-                    events.append(HIDService.crete_event(HIDService.last_right_button_arr[r] + "m", False))
-        if not HIDService.last_button == "":
-            if HIDService.last_button != pressed_key_motion:
+            session.right_show = pressed_key_motion
+            for r in reversed(range(len(session.last_right_button_arr))):
+                if session.last_right_button_arr[r] != "":
+                    events.append(HIDE[MOTION_KEYS[session.last_right_button_arr[r]]])
+        if not session.last_button == "":
+            if session.last_button != pressed_key_motion:
                 # 同在左 或 同在右
                 if diff1 or diff2:  # 不同边
-                    events.append(HIDService.crete_event(HIDService.last_button, False))
+                    events.append(HIDE[session.last_button])
         # self.last_button = pressed_key_motion
 
         if pressed_key_motion in HIDService.left_button:
             # arr = self.last_left_button_arr
             # self.last_left_button_arr[self.last_left_button_i] = pressed_key
-            for k in range(len(HIDService.last_left_button_arr)):
-                if HIDService.last_left_button_arr[k] == "":
-                    HIDService.last_left_button_arr[k] = pressed_key
+            for k in range(len(session.last_left_button_arr)):
+                if session.last_left_button_arr[k] == "":
+                    session.last_left_button_arr[k] = pressed_key
                     break
             # self.last_left_button_i = self.last_left_button_i + 1
         else:
             # arr = self.last_right_button_arr
-            for k in range(len(HIDService.last_right_button_arr)):
-                if HIDService.last_right_button_arr[k] == "":
-                    HIDService.last_right_button_arr[k] = pressed_key
+            for k in range(len(session.last_right_button_arr)):
+                if session.last_right_button_arr[k] == "":
+                    session.last_right_button_arr[k] = pressed_key
                     break
     return events
 
 
-def m_release(pressed_key, pressed_key_motion):
+def m_release(session, pressed_key, pressed_key_motion):
     events = []
     null_count = 0  # 记录last_button_arr有多少“”
     if pressed_key in (LW, LR, LG, LB, RR, RG, RB, RW):
-        if HIDService.release_button[pressed_key] == 1:
+        if session.pressed & BUTTON_BITS[pressed_key]:
             # print(f"{pressed_key} 释放")
             left = pressed_key_motion in HIDService.left_button
 
             if left:
-                button_arr = HIDService.last_left_button_arr
-                show = HIDService.left_show  # 上一个显示的动作图片
+                button_arr = session.last_left_button_arr
+                show = session.left_show  # 上一个显示的动作图片
             else:
-                button_arr = HIDService.last_right_button_arr
-                show = HIDService.right_show  # 同上
+                button_arr = session.last_right_button_arr
+                show = session.right_show  # 同上
 
             # if left:
             # self.last_left_button_i = self.last_left_button_i - 1
@@ -471,29 +347,29 @@ def m_release(pressed_key, pressed_key_motion):
 
                         # 动作图片显示逻辑判断
                         if button_arr[a - 1] != "":
-                            if show != (button_arr[a - 1] + "m") and show != "":
+                            if show != MOTION_KEYS[button_arr[a - 1]] and show != "":
                                 # print(f"{button_arr[a - 1]} 显示")
-                                events.append(HIDService.crete_event(show, False))
-                                events.append(HIDService.crete_event(button_arr[a - 1] + "m", True))
+                                events.append(HIDE[show])
+                                events.append(SHOW[MOTION_KEYS[button_arr[a - 1]]])
                                 if left:
-                                    HIDService.left_show = button_arr[a - 1] + "m"
+                                    session.left_show = MOTION_KEYS[button_arr[a - 1]]
                                 else:
-                                    HIDService.right_show = button_arr[a - 1] + "m"
+                                    session.right_show = MOTION_KEYS[button_arr[a - 1]]
                                 if button_arr[a] != "":
-                                    events.append(HIDService.crete_event(button_arr[a] + "m", False))
+                                    events.append(HIDE[MOTION_KEYS[button_arr[a]]])
                                     button_arr[a] = ""
                                 break
                     else:
                         for b in reversed(range(len(button_arr))):
                             if button_arr[b] != "":
-                                events.append(HIDService.crete_event(button_arr[b] + "m", True))
+                                events.append(SHOW[MOTION_KEYS[button_arr[b]]])
                                 break
                     button_arr[a] = ""
 
                 else:
-                    HIDService.release_button[pressed_key] = 0
-                    events.append(HIDService.crete_event(pressed_key, False))
-                    events.append(HIDService.crete_event(pressed_key_motion, False))
+                    session.pressed &= ~BUTTON_BITS[pressed_key]
+                    events.append(HIDE[pressed_key])
+                    events.append(HIDE[pressed_key_motion])
             for h in range(len(button_arr)):
                 if button_arr[h] == "":
                     # print(f"空的位置 {h}")
@@ -504,39 +380,97 @@ def m_release(pressed_key, pressed_key_motion):
             if null_count == 3:
                 # print(k)
                 # print(f"数组唯一的值 {button_arr[k]}")
-                events.append(HIDService.crete_event(button_arr[k] + "m", True))
+                events.append(SHOW[MOTION_KEYS[button_arr[k]]])
     return events
 
 
+class VisibilityState:
+    """
+    设备当前每张图片的显示状态
+    一次报告中同一个 key 的多次隐藏/显示只保留最终结果，只广播实际变化的 key
+    """
+
+    def __init__(self):
+        self.visible = dict.fromkeys(IMAGE_KEYS, False)  # 页面初始时所有图片都是隐藏的
+
+    def apply(self, events):
+        """应用一次报告的事件，返回显示状态发生变化的事件"""
+        final = {}
+        for event in events:
+            final[event['key']] = event['visible']
+        changes = []
+        for key, visible in final.items():
+            if self.visible.get(key, False) != visible:
+                self.visible[key] = visible
+                changes.append((SHOW if visible else HIDE)[key])
+        return changes
+
+    def snapshot(self):
+        """当前显示中的图片 key"""
+        return [key for key, visible in self.visible.items() if visible]
+
+
+class HIDSession:
+    """
+    单个设备的按键/摇杆显示状态
+    每个 device_id 一份，多台设备同时连接时互不影响
+    """
+    __slots__ = (
+        'pressed', 'last_lever_pos', 'last_pos_image', 'last_button', 'is_show_bg_l0', 'is_show_bg_r0', 'is_left',
+        'last_subpos', 'left_show', 'right_show', 'last_left_button_arr', 'last_right_button_arr',
+        'visibility',
+    )
+
+    def __init__(self):
+        self.pressed = 0  # 按键按下掩码，见 BUTTON_KEYS
+        self.last_lever_pos = ''
+        self.last_pos_image = ''  # last_lever_pos 对应的图片
+        self.last_button = ''
+        self.is_show_bg_l0 = False
+        self.is_show_bg_r0 = False
+        self.is_left = True
+        self.last_subpos = 0
+        self.left_show = ""
+        self.right_show = ""
+        self.last_left_button_arr = ["", "", "", ""]  # 记录左侧按下情况的数组
+        self.last_right_button_arr = ["", "", "", ""]  # 记录右侧按下情况的数组
+        self.visibility = VisibilityState()  # 页面上每张图片的显示状态
+
+
 class HIDService:
-    release_button = {
-        LW: 0,
-        LR: 0,
-        LG: 0,
-        LB: 0,
-        RR: 0,
-        RG: 0,
-        RB: 0,
-        RW: 0,
-    }  # 对应每个按键的按下释放情况  1 按下 0 没按
     right_button = (RR + "m", RG + "m", RB + "m", RW + "m")
     left_button = (LW + "m", LR + "m", LG + "m", LB + "m")
-    last_lever_pos = ''
-    last_button = ''
-    l_motion = ''
-    r_motion = ''
-    is_show_bg_l0 = False
-    is_show_bg_r0 = False
-    is_left = True
-    first_down = True
-    last_subpos = 0
-    last_data = ['', ['']]
-    left_show = ""
-    right_show = ""
-    last_left_button_arr = ["", "", "", ""]  # 记录左侧按下情况的数组
-    last_left_button_i = 0
-    last_right_button_arr = ["", "", "", ""]  # 记录右侧按下情况的数组
-    last_right_button_i = 0
+    sessions = {}  # device_id -> HIDSession
+    last_device_id = None  # 最近一次有输入的设备
+
+    @staticmethod
+    def get_session(device_id):
+        """获取设备的状态，第一次使用时创建"""
+        session = HIDService.sessions.get(device_id)
+        if session is None:
+            session = HIDService.sessions[device_id] = HIDSession()
+        return session
+
+    @staticmethod
+    def diff_display_events(device_id, events):
+        """
+        与该设备当前的显示状态比较，只返回实际变化的事件
+        """
+        HIDService.last_device_id = device_id
+        return HIDService.get_session(device_id).visibility.apply(events)
+
+    @staticmethod
+    def display_snapshot(device_id=None):
+        """
+        设备当前显示中的图片，新连接的页面据此立即恢复画面
+        device_id 为 None 时使用最近一次有输入的设备，没有状态时返回 None
+        """
+        if device_id is None:
+            device_id = HIDService.last_device_id
+        session = HIDService.sessions.get(device_id)
+        if session is None:
+            return None
+        return session.visibility.snapshot()
 
     @staticmethod
     def switches_to_binary_strings(switches_data):
@@ -563,134 +497,37 @@ class HIDService:
             return ["0b00000000 00000000", "0b00000000 00000000"]
 
     @staticmethod
-    def process_structured_hid_data(hid_data):
+    def process_structured_hid_data(hid_data, session=None):
         """
         直接处理结构化 HID 数据
         避免不必要的格式转换
+
+        参数:
+            hid_data: hid_reader 发送的数据
+            session: 设备的 HIDSession，None 时使用默认设备
         """
+        if session is None:
+            session = HIDService.get_session(None)
 
-        #  变量
-        global LW, LR, LG, LB, RR, RG, RB, RW
-        key = ''
-        visible = False
-        events = []
-        event = {
-            'key': key,
-            'visible': visible,
-        }
-        # 显示左右手背景用
-        l_flag = 0
-        r_flag = 0
-        j = 0
-        key_data = []
         try:
             # print("-------------------------services--------------------------")
             # print(f"🔧 直接处理结构化 HID 数据: {hid_data}")
-            if hid_data.get('DEVICE_NAME') in ("io4", 'simgeki'):
-                switches_data = hid_data.get('switches', (0, 0))
-                if hid_data.get('DEVICE_NAME') == "io4":
-                    switches_str = [f"0b{s:016b}" for s in switches_data]
-                else:
-                    switches_str = switches_data
-                # binary_switches = HIDService.switches_to_binary_strings(switches_str)
-                # print(f"🎮 设备状态 - 开关: {switches_str}, 旋钮: {rotary_data}, 系统: {system_status}")
-                # 直接分析 switches 数据的二进制位
-                for switch in switches_str:
-                    bits = switch[2:]  # 去掉 '0b' 前缀
-                    # print(bits)
-                    # 直接将bits字符串转为列表，并确保长度为16
-                    key_data.append(list(bits[:16].ljust(16, '0')))
-
-            elif hid_data.get('DEVICE_NAME') in ('ontroller', 'nageki'):
-                key_data = hid_data.get("key")
-
-            elif hid_data.get('DEVICE_NAME') == 'yuangeki':
-                DEVICE_NAME = hid_data.get("DEVICE_NAME")
-                # 安装全局钩子
-                keyboard.hook(lambda e: None)
-                last_lever_pos = show_lever_KM(hid_data.get('x'), events, DEVICE_NAME)
-                for key_HID in key_states:
-                    key = HID2KM.get(key_HID)  # key 键盘
-                    current_state = keyboard.is_pressed(key)
-                    if current_state != key_states[key_HID]:
-                        # print(f"key {key} current_state {current_state}")
-                        if current_state:
-                            pressed_key_motion = key_HID + "m"
-
-                            # print(f"按下 {key} 键，动作: {pressed_key_motion}")
-                            diff1 = (
-                                    HIDService.last_button in HIDService.left_button and pressed_key_motion in HIDService.left_button)
-                            diff2 = (
-                                    HIDService.last_button in HIDService.right_button and pressed_key_motion in HIDService.right_button)
-                            if HIDService.release_button[key_HID] == 1:
-                                return
-                            press = m_press(key_HID, pressed_key_motion, diff1, diff2, last_lever_pos)
-                            if press:
-                                events = events + press
-                        else:
-                            # print(f"释放 {key} 键")
-                            release = m_release(key_HID, key_HID + "m")
-                            if release:
-                                events = events + release
-                        key_states[key_HID] = current_state
-
-            if hid_data.get("DEVICE_NAME") != 'yuangeki':
-                DEVICE_NAME = hid_data.get("DEVICE_NAME")
-                pressed_keys = []
-                events = []
-                # 显示摇杆
-                result = show_lever(hid_data, key_data, pressed_keys, events, DEVICE_NAME)
-                pressed_keys = result[0]
-                last_lever_pos = result[1]
-                events = result[2]
-
-                for i in (LW, LR, LG, LB, RR, RG, RW, RB):
-                    current = False
-                    for ind in range(len(pressed_keys)):
-                        if pressed_keys[ind] == i:
-                            # print(data_hid)
-                            current = True
-                    pressed_key = str(i)
-                    pressed_key_motion = pressed_key + "m"  # 手部图片
-
-                    # 判断是否同侧
-                    diff1 = (
-                            HIDService.last_button in HIDService.left_button and pressed_key_motion
-                            in HIDService.left_button)
-                    diff2 = (
-                            HIDService.last_button in HIDService.right_button and pressed_key_motion
-                            in HIDService.right_button)
-
-                    if not (pressed_key in (LW, LR, LG, LB, RR, RG, RB, RW)):  # 不在这8个键不会反应
-                        continue
-                    if current:  # press
-                        if HIDService.release_button[pressed_key] == 1:
-                            continue
-                        press = m_press(pressed_key, pressed_key_motion, diff1, diff2, last_lever_pos)
-                        if press:
-                            events = events + press
-                    else:  # release
-                        release = m_release(pressed_key, pressed_key_motion, )
-                        if release:
-                            events = events + release
-
-            # 判断左边右边分别有多少按键
-            for i in HIDService.release_button.keys():
-                if j < 4:
-                    l_flag = l_flag + HIDService.release_button[i]
+            DEVICE_NAME = hid_data.get("DEVICE_NAME")
+            lever = get_lever_calibration(DEVICE_NAME)
+            if DEVICE_NAME == 'yuangeki':
+                # 键盘由 hid_reader 监听，直接给出按下掩码
+                position = hid_data.get('x')
+                sub_pos = lever.sub_position(position)
+                mask = hid_data.get('buttons', 0) & (LEFT_MASK | RIGHT_MASK)
+            else:
+                if DEVICE_NAME in ("io4", "simgeki"):
+                    position = hid_data.get('rotary')[1]
+                    sub_pos = lever.sub_position(hid_data.get('rotary')[0])
                 else:
-                    r_flag = r_flag + HIDService.release_button[i]
-                j = j + 1
-
-            if l_flag == 0:
-                events.append(HIDService.crete_event("l_0", True))
-            if r_flag == 0:
-                events.append(HIDService.crete_event("r_0", True))
-            if not HIDService.is_show_bg_l0:
-                events.append(HIDService.crete_event("l_0", False))
-            if not HIDService.is_show_bg_r0:
-                events.append(HIDService.crete_event("r_0", False))
-            return events
+                    position = hid_data.get("pos")  # 摇杆位置
+                    sub_pos = lever.sub_position(hid_data.get("sub_pos"))
+                mask = HIDService.pressed_mask(hid_data, DEVICE_NAME)
+            return transitions.step(session, position, lever.zone_key(position), sub_pos, mask)
 
         except Exception as e:
             print(f"❌ 结构化数据处理错误: {e}")
@@ -699,37 +536,139 @@ class HIDService:
             return []
 
     @staticmethod
-    def get_sub_position(rotary0, device_name):
-        if device_name == 'io4':
-            total_range = 65536  # 32768 - (-32768)
-            sub_range_size = total_range / 20  # 3276.8
-            sub_pos = int((rotary0 + 32768) // sub_range_size)  # 映射到0~19
+    def transition(session, position, pos_image, sub_pos, mask):
+        """
+        一次报告的状态转换：摇杆 + 按键按下/释放，返回显示事件
+
+        参数:
+            session: 设备的 HIDSession
+            position: 摇杆位置
+            pos_image: 摇杆位置的图片（lever_N）
+            sub_pos: 子位置
+            mask: 按下掩码
+        """
+        # 显示摇杆
+        last_lever_pos, events = show_lever(session, position, pos_image, sub_pos, [])
+
+        # 与上一次的按下掩码比较，只处理变化的按键
+        changed = mask ^ session.pressed
+        if changed:
+            for pressed_key, pressed_key_motion, bit in PROCESS_ORDER:  # pressed_key_motion 为手部图片
+                if not changed & bit:
+                    continue
+
+                # 判断是否同侧
+                diff1 = (
+                        session.last_button in HIDService.left_button and pressed_key_motion
+                        in HIDService.left_button)
+                diff2 = (
+                        session.last_button in HIDService.right_button and pressed_key_motion
+                        in HIDService.right_button)
+
+                if mask & bit:  # press
+                    press = m_press(session, pressed_key, pressed_key_motion, diff1, diff2, last_lever_pos)
+                    if press:
+                        events = events + press
+                else:  # release
+                    release = m_release(session, pressed_key, pressed_key_motion, )
+                    if release:
+                        events = events + release
+
+        # 左边右边都没有按键时显示手的背景
+        if not session.pressed & LEFT_MASK:
+            events.append(SHOW["l_0"])
+        if not session.pressed & RIGHT_MASK:
+            events.append(SHOW["r_0"])
+        if not session.is_show_bg_l0:
+            events.append(HIDE["l_0"])
+        if not session.is_show_bg_r0:
+            events.append(HIDE["r_0"])
+        return events
+
+    @staticmethod
+    def pressed_mask(hid_data, device_name):
+        """
+        把报告中的按键转换为按下掩码（见 BUTTON_KEYS），只做查表和位运算
+        """
+        if device_name in ('io4', 'simgeki'):
+            mask = 0
+            for (low, high), inverted, switch in zip(IO4_SWITCH_TABLES, IO4_INVERTED, hid_data.get('switches', (0, 0))):
+                word = switch_word(switch) ^ inverted
+                mask |= low[word & 0xFF] | high[word >> 8 & 0xFF]
+            if hid_data.get('system_status', 0) == 0:
+                mask |= BUTTON_BITS[LW]
+            return mask
+        if device_name == 'ontroller' and int(hid_data.get('idk', 0)) == 1:
+            table = KEY_TABLES['ontroller_idk']
         else:
-            total_range = 255
-            sub_range_size = total_range / 20
-            sub_pos = int(rotary0 // sub_range_size)  # 映射到0~19
-        return min(max(sub_pos, 0), 19)  # 限制在0~19
+            table = KEY_TABLES[device_name]
+        return table[key_bits(hid_data) & (len(table) - 1)]
+
+
+class TransitionEngine:
+    """
+    带 LRU 缓存的状态转换
+
+    HIDService.transition 的结果只取决于紧凑状态（按下掩码、左右两侧的按下顺序、
+    上一次的摇杆图片、is_left 等）和输入（摇杆图片、摇杆是否移动、子位置是否不变、按下掩码），
+    缓存 (状态, 输入) -> (下一状态, 事件)，连打、摇杆来回扫动等重复的输入只需一次字典查找。
+    返回的事件在多次报告间共享，调用方不能修改。
+    """
+
+    def __init__(self, maxsize=4096):
+        self.cached_transition = lru_cache(maxsize=maxsize)(self.compute)
 
     @staticmethod
-    def get_pos(position):
-        global L_2, L_1, R_1, R_2
-        pos_image = ""
-        if position >= L_2:
-            pos_image = "lever_-2"
-        if L_2 > position >= L_1:
-            pos_image = "lever_-1"
-        if L_1 > position >= R_1:
-            pos_image = "lever_0"
-        if R_1 > position >= R_2:
-            pos_image = "lever_1"
-        if R_2 > position:
-            pos_image = "lever_2"
-        return pos_image
+    def pack(session):
+        """把 session 中影响状态转换的部分打包为可哈希的元组"""
+        return (
+            session.pressed, session.last_pos_image, session.last_button,
+            session.is_show_bg_l0, session.is_show_bg_r0, session.is_left,
+            session.left_show, session.right_show,
+            tuple(session.last_left_button_arr), tuple(session.last_right_button_arr),
+        )
 
     @staticmethod
-    def crete_event(key, visible):
-        event = {
-            'key': key,
-            'visible': visible,
+    def unpack(state, session):
+        (session.pressed, session.last_pos_image, session.last_button,
+         session.is_show_bg_l0, session.is_show_bg_r0, session.is_left,
+         session.left_show, session.right_show, left_arr, right_arr) = state
+        session.last_left_button_arr = list(left_arr)
+        session.last_right_button_arr = list(right_arr)
+
+    @staticmethod
+    def compute(state, pos_image, moved, still, mask):
+        """缓存未命中时在临时 session 上执行一次 HIDService.transition"""
+        scratch = HIDSession()
+        TransitionEngine.unpack(state, scratch)
+        # 只有相等关系会影响结果，用 0/1 代替真实的摇杆位置和子位置
+        scratch.last_lever_pos = 0 if scratch.last_pos_image else ''
+        scratch.last_subpos = 0
+        events = HIDService.transition(scratch, 1 if moved else 0, pos_image, 0 if still else 1, mask)
+        return TransitionEngine.pack(scratch), tuple(events)
+
+    def step(self, session, position, pos_image, sub_pos, mask):
+        """处理一次报告，更新 session 并返回显示事件"""
+        moved = session.last_lever_pos != position
+        still = session.last_subpos == sub_pos
+        state, events = self.cached_transition(self.pack(session), pos_image, moved, still, mask)
+        self.unpack(state, session)
+        if moved:
+            session.last_lever_pos = position
+        else:
+            session.last_subpos = sub_pos
+        return events
+
+    def stats(self):
+        info = self.cached_transition.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'hit_ratio': info.hits / lookups if lookups else 0.0,
+            'size': info.currsize,
         }
-        return event
+
+
+# 所有设备共用的状态转换缓存
+transitions = TransitionEngine(maxsize=4096)
@@ -8,6 +8,7 @@ from . import views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.index, name='index'),
+    path('device/<slug:device_id>/', views.index, name='device_index'),
 ]
 
 # 开发环境静态文件服务 - 使用 STATICFILES_DIRS[0]
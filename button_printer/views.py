@@ -4,10 +4,15 @@ import json
 from django.shortcuts import render
 from django.http import JsonResponse
 from .models import ButtonConfig
+from .services import IMAGE_KEYS
 
 
-def index(request):
-    """主页面 - 从数据库获取所有按钮配置"""
+def index(request, device_id=None):
+    """
+    主页面 - 从数据库获取所有按钮配置
+    device_id: 只显示该设备（device/<device_id>/），None 时显示所有设备的输入
+    """
+    websocket_url = f'/ws/hid/{device_id}/' if device_id else '/ws/hid/'
     try:
         # 从数据库获取所有按钮配置
         button_configs = ButtonConfig.objects.all()
@@ -37,7 +42,9 @@ def index(request):
             'title': 'OngekiButtonPrinterWeb',
             'version': '1.0.0',
             'buttons_data_json': buttons_data_json,
-            'websocket_url': '/ws/hid/'
+            # image id -> key，下标即 id，二进制显示更新中使用
+            'image_manifest_json': json.dumps(IMAGE_KEYS),
+            'websocket_url': websocket_url
         }
 
         print("✅ 上下文数据准备完成")
@@ -51,7 +58,8 @@ def index(request):
             'title': 'OngekiButtonPrinterWeb',
             'version': '1.0.0',
             'buttons_data_json': '[]',
-            'websocket_url': '/ws/hid/'
+            'image_manifest_json': '[]',
+            'websocket_url': websocket_url
         }
 
     return render(request, 'button_printer/index.html', context)
@@ -1,4 +1,5 @@
 # insert_buttons.py - 放在项目根目录
+import configparser
 import os
 import django
 
@@ -7,6 +8,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ongeki_helper_Web.settings')
 django.setup()
 
 from button_printer.models import ButtonConfig
+from button_printer.lever import lever_labels
 
 # 31 0 5 4 | 1 16 15 14 ←从左到右是左侧键到右侧键
 LW = "31"
@@ -19,6 +21,11 @@ RG = "16"
 RB = "15"
 RW = "14"
 
+# 摇杆分区数
+config = configparser.ConfigParser()
+config.read(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'button_printer', 'config.ini'))
+LEVER_ZONES = int(config.get('boundary', 'zones', fallback='5'))
+
 
 def main():
     """插入按钮数据"""
@@ -49,29 +56,17 @@ def main():
         (RW, '7_on.png'),
         (RW + "m", '7.png'),
 
-        ('l_lever_0', 'l_swing_0.png'),
-        ('l_lever_1', 'l_swing_1.png'),
-        ('l_lever_2', 'l_swing_2.png'),
-        ('l_lever_-1', 'l_swing_-1.png'),
-        ('l_lever_-2', 'l_swing_-2.png'),
-
-        ('r_lever_0', 'r_swing_0.png'),
-        ('r_lever_1', 'r_swing_1.png'),
-        ('r_lever_2', 'r_swing_2.png'),
-        ('r_lever_-1', 'r_swing_-1.png'),
-        ('r_lever_-2', 'r_swing_-2.png'),
-
-        ('lever_0', 'swing_0.png'),
-        ('lever_1', 'swing_1.png'),
-        ('lever_2', 'swing_2.png'),
-        ('lever_-1', 'swing_-1.png'),
-        ('lever_-2', 'swing_-2.png'),
-
         ('bg_swing', 'swing.png'),
         ('l_0', 'l_0.png'),
         ('r_0', 'r_0.png'),
     ]
 
+    # 摇杆图片，分区数与 config.ini 中的 zones 一致
+    for label in lever_labels(LEVER_ZONES):
+        button_configs.append((f'l_lever_{label}', f'l_swing_{label}.png'))
+        button_configs.append((f'r_lever_{label}', f'r_swing_{label}.png'))
+        button_configs.append((f'lever_{label}', f'swing_{label}.png'))
+
     print("开始插入按钮数据...")
 
     for key, image in button_configs:
@@ -3,7 +3,9 @@ class HIDController {
     constructor() {
         this.socket = null;
         this.images = new Map();
+        this.imagesById = [];  // image id -> 图片元素，与服务器的 IMAGE_MANIFEST 对应
         this.isConnected = false;
+        this.lostDevices = new Set();  // hid_reader 报告已断开的设备
         this.reconnectAttempts = 0;
         this.maxReconnectAttempts = 5;
 
@@ -54,9 +56,8 @@ class HIDController {
         img.setAttribute('data-key', button.key);
         img.className = 'dynamic-button hidden';
         img.alt = button.image_name || button.key;
-        const swing = ["lever_-1", "lever_-2", "lever_0", "lever_1", "lever_2", ]
-        const swingSet = new Set(swing)
-        if (swingSet.has(button.key)){
+        // 摇杆图片 lever_N，分区数由 config.ini 决定
+        if (/^lever_-?\d+$/.test(button.key)){
             img.classList.add('z-swing')
         }
         else {img.classList.add('z-buttons')}
@@ -77,6 +78,11 @@ class HIDController {
     });
 
     console.log(`🎯 成功创建 ${createdCount} 个叠加按钮图片`);
+
+    // 二进制显示更新中只有 image id，预先建立 id -> 图片元素的数组
+    if (typeof IMAGE_MANIFEST !== 'undefined') {
+        this.imagesById = IMAGE_MANIFEST.map(key => this.images.get(key) || null);
+    }
 }
 
 
@@ -87,7 +93,9 @@ class HIDController {
   setupWebSocket() {
     try {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${protocol}//${window.location.host}${WEBSOCKET_URL}`;
+        // 有 image id 清单时使用二进制显示更新（每个事件 2 字节: image_id visible）
+        const wire = this.imagesById.length > 0 ? '?wire=ids1' : '';
+        const wsUrl = `${protocol}//${window.location.host}${WEBSOCKET_URL}${wire}`;
 
         // 使用二进制传输（如果可能）
         this.socket = new WebSocket(wsUrl);
@@ -118,6 +126,11 @@ class HIDController {
             // 立即处理，不等待
             const startTime = performance.now();
 
+            if (event.data instanceof ArrayBuffer) {
+                this.processDisplayFrame(new Uint8Array(event.data));
+                return;
+            }
+
             try {
                 const data = JSON.parse(event.data);
                 this.handleMessage(data);
@@ -146,6 +159,10 @@ class HIDController {
 
         if (data.type === 'batch_display_update') {
             this.processDisplayUpdateImmediately(data.events);
+        } else if (data.type === 'display_snapshot') {
+            this.applyDisplaySnapshot(data.visible);
+        } else if (data.type === 'device_status') {
+            this.applyDeviceStatus(data.device_id, data.connected);
         }
 
         const processTime = performance.now() - startTime;
@@ -186,6 +203,64 @@ class HIDController {
         });
     }
 
+    /**
+     * 处理二进制显示更新：[image_id, visible] 每个事件 2 字节
+     */
+    processDisplayFrame(frame) {
+        const firstimageContainer = document.getElementById('first-image-container');
+        firstimageContainer.classList.add('first-display');
+        for (let i = 0; i + 1 < frame.length; i += 2) {
+            const imageElement = this.imagesById[frame[i]];
+            if (!imageElement) continue;
+
+            if (frame[i + 1]) {
+                imageElement.classList.remove('hidden');
+                imageElement.classList.add('visible');
+            } else {
+                imageElement.classList.remove('visible');
+                imageElement.classList.add('hidden');
+            }
+        }
+        this.forceSyncReflow();
+    }
+
+    /**
+     * 设备断开 / 重新连接：有断开的设备时显示提示并淡化画面
+     */
+    applyDeviceStatus(deviceId, connected) {
+        if (connected) {
+            this.lostDevices.delete(deviceId);
+        } else {
+            this.lostDevices.add(deviceId);
+        }
+        const lost = this.lostDevices.size > 0;
+        document.body.classList.toggle('device-lost', lost);
+        const status = document.getElementById('device-status');
+        if (status) {
+            status.textContent = lost ? `手台已断开: ${[...this.lostDevices].join(', ')}` : '';
+        }
+    }
+
+    /**
+     * 应用连接时的画面快照：列表中的图片显示，其余隐藏
+     */
+    applyDisplaySnapshot(visibleKeys) {
+        if (!visibleKeys || !Array.isArray(visibleKeys)) return;
+        const visible = new Set(visibleKeys);
+        const firstimageContainer = document.getElementById('first-image-container');
+        firstimageContainer.classList.add('first-display');
+        for (const [key, imageElement] of this.images) {
+            if (visible.has(key)) {
+                imageElement.classList.remove('hidden');
+                imageElement.classList.add('visible');
+            } else {
+                imageElement.classList.remove('visible');
+                imageElement.classList.add('hidden');
+            }
+        }
+        this.forceSyncReflow();
+    }
+
     /**
      * 强制同步重绘
      */
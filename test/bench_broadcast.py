@@ -0,0 +1,134 @@
+# test/bench_broadcast.py
+# 每次广播 batch_display_update 的 CPU 时间，经过实际的 consumers.broadcast_display 和 HIDConsumer.hid_broadcast
+# 每客户端编码（改动前：hid_action + 每个连接 json.dumps）/ channel_layer 广播后端 / local 进程内注册表 的比较
+import asyncio
+import json
+import os
+import sys
+import time
+
+import django
+from django.conf import settings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+settings.configure(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+django.setup()
+
+from channels.layers import get_channel_layer
+
+from button_printer import fanout
+from button_printer.consumers import VIEWER_GROUP, HIDConsumer, broadcast_display, build_display_update
+from button_printer.hid_protocol import DISPLAY_WIRE_NAME
+from button_printer.outbox import ClientOutbox
+
+CLIENT_COUNTS = (1, 10, 200)
+ROUNDS = 200
+
+EVENTS = [{'key': key, 'visible': visible} for key, visible in (
+    ('5', True), ('5m', True), ('0m', False), ('l_0', False), ('lever_-1', False),
+    ('l_lever_-1', True), ('r_lever_-1', False), ('bg_swing', False),
+)]
+
+
+class BenchClient:
+    """只有发送队列的 HIDConsumer，hid_broadcast 与实际连接相同"""
+    hid_broadcast = HIDConsumer.hid_broadcast
+    encode_display = HIDConsumer.encode_display
+    decode_display = HIDConsumer.decode_display
+
+    def __init__(self, wire, channel_layer=None, channel_name=None):
+        self.wire = wire
+        self.channel_layer = channel_layer
+        self.channel_name = channel_name
+        self.outbox = ClientOutbox(
+            self.send_encoded, self.encode_display, self.decode_display, maxsize=ROUNDS + 1)
+
+    async def send_encoded(self, message):
+        pass
+
+    def sent_messages(self):
+        count = len(self.outbox.pending)
+        self.outbox.pending.clear()
+        return count
+
+
+def make_wires(client_count):
+    """一半页面使用 ids1，一半使用 JSON"""
+    return [DISPLAY_WIRE_NAME if i % 2 else 'json' for i in range(client_count)]
+
+
+async def run_per_client(client_count):
+    """改动前：广播事件列表，每个连接各自 json.dumps"""
+    layer = get_channel_layer()
+    channels = []
+    for _ in range(client_count):
+        channel = await layer.new_channel()
+        await layer.group_add(VIEWER_GROUP, channel)
+        channels.append(channel)
+
+    sent = 0
+    start = time.process_time()
+    for _ in range(ROUNDS):
+        await layer.group_send(VIEWER_GROUP, {'type': 'hid_action', 'action': build_display_update(EVENTS)})
+        for channel in channels:
+            message = await layer.receive(channel)
+            json.dumps(message['action'])
+            sent += 1
+    elapsed = time.process_time() - start
+    for channel in channels:
+        await layer.group_discard(VIEWER_GROUP, channel)
+    return elapsed / ROUNDS * 1e6, sent
+
+
+async def run_channel_layer(client_count):
+    layer = get_channel_layer()
+    fanout._fanout = fanout.ChannelLayerFanout()
+    clients = []
+    for wire in make_wires(client_count):
+        client = BenchClient(wire, layer, await layer.new_channel())
+        await fanout._fanout.subscribe(client, VIEWER_GROUP)
+        clients.append(client)
+
+    sent = 0
+    start = time.process_time()
+    for _ in range(ROUNDS):
+        await broadcast_display(EVENTS)
+        for client in clients:
+            await client.hid_broadcast(await layer.receive(client.channel_name))
+        sent += sum(client.sent_messages() for client in clients)
+    elapsed = time.process_time() - start
+    for client in clients:
+        await fanout._fanout.unsubscribe(client, VIEWER_GROUP)
+    return elapsed / ROUNDS * 1e6, sent
+
+
+async def run_local(client_count):
+    fanout._fanout = fanout.LocalFanout()
+    clients = [BenchClient(wire) for wire in make_wires(client_count)]
+    for client in clients:
+        await fanout._fanout.subscribe(client, VIEWER_GROUP)
+
+    sent = 0
+    start = time.process_time()
+    for _ in range(ROUNDS):
+        await broadcast_display(EVENTS)
+        sent += sum(client.sent_messages() for client in clients)
+    elapsed = time.process_time() - start
+    return elapsed / ROUNDS * 1e6, sent
+
+
+def main():
+    print(f"{'客户端数':<10}{'每客户端编码 us/次':>20}{'channel_layer us/次':>20}{'local us/次':>20}")
+    for client_count in CLIENT_COUNTS:
+        old_us, old_sent = asyncio.run(run_per_client(client_count))
+        layer_us, layer_sent = asyncio.run(run_channel_layer(client_count))
+        local_us, local_sent = asyncio.run(run_local(client_count))
+        assert old_sent == layer_sent == local_sent == client_count * ROUNDS
+        print(f"{client_count:<10}{old_us:>20.1f}{layer_us:>20.1f}{local_us:>20.1f}")
+
+
+if __name__ == "__main__":
+    main()
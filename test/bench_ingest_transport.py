@@ -0,0 +1,251 @@
+# test/bench_ingest_transport.py
+# hid_reader -> 服务器 单程延迟：WebSocket（bin1 二进制帧） / UDP 数据报 / Unix 数据报 / 共享内存 + UDP 门铃
+# 接收端在另一个线程的事件循环中运行，延迟为 发送前 ~ 接收端解码完成 的时间
+# WebSocket 只是 websockets 库的服务器，不含 Daphne/channels 的开销，实际差距更大
+# 最后检查数据报入口在 hid_reader 重新启动（seq 从 1 开始）后不会把新帧当作过期帧丢弃，
+# 以及队列满时丢弃的是最早的帧
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from websockets.asyncio.client import connect
+from websockets.asyncio.server import serve
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'button_printer'))
+sys.path.insert(0, ROOT)
+
+from hid_protocol import DATAGRAM, DOORBELL, StateSegment, decode_frame, encode_frame, new_generation
+from button_printer.datagram import QUEUE_SIZE, DatagramIngestProtocol
+
+FRAMES = 2000
+INTERVAL = 0.001  # 与读取频率类似，每 1ms 发送一帧
+DATA = {
+    'rotary': [-1200, 15000, 0, 0],
+    'switches': [8960, 448],
+    'system_status': 1,
+    'DEVICE_NAME': 'io4'
+}
+
+
+class Receiver:
+    """接收端：记录每个 seq 解码完成的时间"""
+
+    def __init__(self):
+        self.arrivals = {}
+        self.done = threading.Event()
+
+    def frame(self, data):
+        _, seq, _ = decode_frame(data)
+        self.arrivals[seq] = time.perf_counter_ns()
+        if len(self.arrivals) >= FRAMES:
+            self.done.set()
+
+
+class DatagramReceiver(asyncio.DatagramProtocol):
+    def __init__(self, receiver):
+        self.receiver = receiver
+
+    def datagram_received(self, data, addr):
+        self.receiver.frame(data)
+
+
+def start_server_thread(start):
+    """在新线程的事件循环中运行 start(loop)，返回 (loop, 线程)"""
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(start(loop))
+        ready.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait()
+    return loop, thread
+
+
+def stop_server_thread(loop, thread):
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+async def send_frames(send):
+    """按 INTERVAL 发送 FRAMES 帧，返回每个 seq 的发送时间"""
+    sent = {}
+    for seq in range(1, FRAMES + 1):
+        frame = encode_frame(DATA, 0, seq)
+        sent[seq] = time.perf_counter_ns()
+        await send(frame)
+        await asyncio.sleep(INTERVAL)
+    return sent
+
+
+async def bench_websocket():
+    receiver = Receiver()
+
+    async def handler(websocket):
+        async for message in websocket:
+            receiver.frame(message)
+
+    servers = []
+
+    async def start(loop):
+        servers.append(await serve(handler, '127.0.0.1', 0))
+
+    loop, thread = start_server_thread(start)
+    port = servers[0].sockets[0].getsockname()[1]
+    async with connect(f'ws://127.0.0.1:{port}/', ping_interval=20, ping_timeout=10) as websocket:
+        sent = await send_frames(websocket.send)
+        await asyncio.to_thread(receiver.done.wait, 5)
+    loop.call_soon_threadsafe(servers[0].close)
+    asyncio.run_coroutine_threadsafe(servers[0].wait_closed(), loop).result()
+    stop_server_thread(loop, thread)
+    return sent, receiver.arrivals
+
+
+async def bench_datagram(family, address):
+    receiver = Receiver()
+
+    transports = []
+
+    async def start(loop):
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: DatagramReceiver(receiver), local_addr=address, family=family)
+        transports.append(transport)
+
+    loop, thread = start_server_thread(start)
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.connect(transports[0].get_extra_info('sockname'))
+
+    async def send(frame):
+        sock.send(frame)
+
+    sent = await send_frames(send)
+    await asyncio.to_thread(receiver.done.wait, 5)
+    sock.close()
+    loop.call_soon_threadsafe(transports[0].close)
+    stop_server_thread(loop, thread)
+    return sent, receiver.arrivals
+
+
+class DoorbellReceiver(asyncio.DatagramProtocol):
+    """收到门铃后读取共享内存中的最新帧"""
+
+    def __init__(self, receiver, segment):
+        self.receiver = receiver
+        self.segment = segment
+
+    def datagram_received(self, data, addr):
+        _, slot = DOORBELL.unpack(data)
+        self.receiver.frame(self.segment.read(slot))
+
+
+async def bench_shared_memory():
+    receiver = Receiver()
+    # 同一进程内读写同一个段，只比较 seqlock 读写和门铃的开销
+    segment = StateSegment.create(f'bench_{os.getpid()}')
+    doorbell = DOORBELL.pack(segment.generation, 0)
+    transports = []
+
+    async def start(loop):
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: DoorbellReceiver(receiver, segment), local_addr=('127.0.0.1', 0))
+        transports.append(transport)
+
+    loop, thread = start_server_thread(start)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.connect(transports[0].get_extra_info('sockname'))
+
+    async def send(frame):
+        segment.write(0, frame)
+        sock.send(doorbell)
+
+    sent = await send_frames(send)
+    await asyncio.to_thread(receiver.done.wait, 5)
+    sock.close()
+    loop.call_soon_threadsafe(transports[0].close)
+    stop_server_thread(loop, thread)
+    segment.close()
+    return sent, receiver.arrivals
+
+
+async def check_restart():
+    """两个 hid_reader 进程先后从同一个（没有地址的 Unix）发送方发送，seq 都从 1 开始"""
+    ingested = []
+
+    async def ingest(device_id, hid_data):
+        ingested.append(device_id)
+
+    protocol = DatagramIngestProtocol(ingest)
+    protocol.connection_made(None)
+    for _ in range(2):
+        header = DATAGRAM.pack(new_generation())
+        for seq in range(1, 51):
+            protocol.datagram_received(header + encode_frame(DATA, 0, seq), None)
+        # 同一个进程中的旧帧仍然丢弃
+        protocol.datagram_received(header + encode_frame(DATA, 0, 10), None)
+    while not protocol.queue.empty():
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    protocol.task.cancel()
+    stats = protocol.stats()
+    assert len(ingested) == 100 and stats['stale_frames'] == 2, stats
+    # 只保留最新 generation 的记录
+    assert len(protocol.last_seq) == 1, protocol.last_seq
+    print(f"重新启动: 处理 {len(ingested)} 帧，过期 {stats['stale_frames']} 帧")
+
+
+async def check_queue_full():
+    """处理任务还没运行时收到超过 QUEUE_SIZE 的帧，保留的是最新的帧"""
+    levers = []
+
+    async def ingest(device_id, hid_data):
+        levers.append(hid_data['rotary'][1])
+
+    protocol = DatagramIngestProtocol(ingest)
+    protocol.connection_made(None)
+    header = DATAGRAM.pack(new_generation())
+    total = QUEUE_SIZE + 10
+    for seq in range(1, total + 1):
+        data = dict(DATA, rotary=[0, seq, 0, 0])
+        protocol.datagram_received(header + encode_frame(data, 0, seq), None)
+    while not protocol.queue.empty():
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    protocol.task.cancel()
+    assert levers == list(range(11, total + 1)), levers[:3]
+    print(f"队列满: 丢弃最早的 {protocol.stats()['dropped']} 帧，最后处理 seq={levers[-1]}")
+
+
+def report(name, sent, arrivals):
+    latencies = sorted((arrivals[seq] - sent[seq]) / 1000 for seq in arrivals)
+    lost = len(sent) - len(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{name:<12}{statistics.median(latencies):>10.1f}{statistics.mean(latencies):>10.1f}{p99:>10.1f}{lost:>8}")
+
+
+async def main():
+    print(f"{'方式':<10}{'中位us':>10}{'平均us':>10}{'p99 us':>10}{'丢失':>8}")
+    report('websocket', *await bench_websocket())
+    report('udp', *await bench_datagram(socket.AF_INET, ('127.0.0.1', 0)))
+    if hasattr(socket, 'AF_UNIX'):
+        path = os.path.join(tempfile.mkdtemp(), 'bench.sock')
+        report('unix', *await bench_datagram(socket.AF_UNIX, path))
+        os.unlink(path)
+    report('shm+udp', *await bench_shared_memory())
+    await check_restart()
+    await check_queue_full()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+# test/bench_transitions.py
+# 每次报告的状态转换耗时：直接执行 HIDService.transition / 经过 LRU 缓存（transitions.step）
+# 输入为 ontroller 的连打和摇杆来回扫动
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from button_printer.services import HIDService, HIDSession, TransitionEngine, get_lever_calibration
+
+NUMBER = 20
+
+
+def make_reports():
+    """连打 LR/LG（bit 1、bit 2），同时摇杆在 0~255 间来回移动"""
+    reports = []
+    for i in range(2000):
+        key = ('01000000', '00100000', '01100000', '00000000')[i % 4]
+        sweep = i % 64
+        pos = sweep * 4 if sweep < 32 else (63 - sweep) * 4
+        reports.append({'DEVICE_NAME': 'ontroller', 'pos': pos, 'sub_pos': pos, 'key': key, 'idk': 0})
+    return reports
+
+
+def main():
+    reports = make_reports()
+    lever = get_lever_calibration('ontroller')
+    inputs = []
+    for data in reports:
+        position = data['pos']
+        inputs.append((position, lever.zone_key(position), lever.sub_position(data['sub_pos']),
+                       HIDService.pressed_mask(data, 'ontroller')))
+
+    def direct():
+        session = HIDSession()
+        for position, pos_image, sub_pos, mask in inputs:
+            HIDService.transition(session, position, pos_image, sub_pos, mask)
+
+    engine = TransitionEngine()
+
+    def cached():
+        session = HIDSession()
+        for position, pos_image, sub_pos, mask in inputs:
+            engine.step(session, position, pos_image, sub_pos, mask)
+
+    direct_us = timeit.timeit(direct, number=NUMBER) / NUMBER / len(inputs) * 1e6
+    cached_us = timeit.timeit(cached, number=NUMBER) / NUMBER / len(inputs) * 1e6
+    print(f"{'方式':<10}{'每次报告us':>12}")
+    print(f"{'direct':<10}{direct_us:>12.2f}")
+    print(f"{'cached':<10}{cached_us:>12.2f}")
+    print(f"缓存: {engine.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# test/bench_wire_protocol.py
+# 比较 JSON 与二进制帧(bin1)每条消息的字节数和解析耗时
+# 以及发给页面的显示更新 JSON 与 ids1 的字节数和编码耗时
+import json
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'button_printer'))
+
+from hid_protocol import decode_frame, encode_display_frame, encode_frame
+
+SAMPLES = {
+    'io4': {
+        'rotary': [-1200, 15000, 0, 0],
+        'switches': [8960, 448],
+        'system_status': 1,
+        'DEVICE_NAME': 'io4'
+    },
+    'simgeki': {
+        'rotary': [120, 130, 0, 0],
+        'switches': ['0b0100000000000000', '0b0000000001001000'],
+        'system_status': 1,
+        'DEVICE_NAME': 'simgeki'
+    },
+    'ontroller': {
+        'sub_pos': 120,
+        'pos': 130,
+        'key': '10010000',
+        'DEVICE_NAME': 'ontroller',
+        'idk': 0
+    },
+    'nageki': {
+        'sub_pos': 120,
+        'pos': -130,
+        'key': '1001000010',
+        'DEVICE_NAME': 'nageki',
+        'idk': 0
+    },
+}
+NUMBER = 100000
+
+# 一次按键的显示更新，image id 与 services.IMAGE_IDS 相同
+DISPLAY_EVENTS = [{'key': key, 'visible': visible} for key, visible in (
+    ('5', True), ('5m', True), ('0m', False), ('l_0', False), ('lever_-1', False),
+    ('l_lever_-1', True), ('r_lever_-1', False), ('bg_swing', False),
+)]
+IMAGE_IDS = {'5': 4, '5m': 5, '0m': 3, 'l_0': 32, 'lever_-1': 27, 'l_lever_-1': 17, 'r_lever_-1': 22, 'bg_swing': 31}
+
+
+def json_message(data):
+    """与 hid_reader 发送的 JSON 消息相同"""
+    return json.dumps({
+        'type': 'hid_data',
+        'device_id': 'hid_0ca3_0021',
+        'timestamp': time.time(),
+        'data': data
+    })
+
+
+def main():
+    print(f"{'设备':<10}{'JSON字节':>10}{'bin1字节':>10}{'JSON解析us':>12}{'bin1解析us':>12}")
+    for name, data in SAMPLES.items():
+        text = json_message(data)
+        frame = encode_frame(data, 0, 1)
+        # 解码后重新编码得到相同的帧
+        assert encode_frame(decode_frame(frame)[2], 0, 1) == frame, name
+        json_us = timeit.timeit(lambda: json.loads(text), number=NUMBER) / NUMBER * 1e6
+        bin_us = timeit.timeit(lambda: decode_frame(frame), number=NUMBER) / NUMBER * 1e6
+        print(f"{name:<10}{len(text.encode()):>10}{len(frame):>10}{json_us:>12.2f}{bin_us:>12.2f}")
+
+    print()
+    print(f"{'显示更新':<10}{'JSON字节':>10}{'ids1字节':>10}{'JSON编码us':>12}{'ids1编码us':>12}")
+    def display_json():
+        return json.dumps({
+            'type': 'batch_display_update',
+            'events': DISPLAY_EVENTS,
+            'total_events': len(DISPLAY_EVENTS),
+            'timestamp': time.time(),
+            'high_priority': True
+        })
+
+    text = display_json()
+    frame = encode_display_frame(DISPLAY_EVENTS, IMAGE_IDS)
+    json_us = timeit.timeit(display_json, number=NUMBER) / NUMBER * 1e6
+    ids_us = timeit.timeit(lambda: encode_display_frame(DISPLAY_EVENTS, IMAGE_IDS), number=NUMBER) / NUMBER * 1e6
+    print(f"{len(DISPLAY_EVENTS):<10}{len(text.encode()):>10}{len(frame):>10}{json_us:>12.2f}{ids_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
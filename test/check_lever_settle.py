@@ -0,0 +1,60 @@
+# test/check_lever_settle.py
+# 摇杆移动后手放下：hid_reader 不再发送没有变化的报告，摇杆停下后补发 SETTLE_REPORTS(2) 次最后的状态，
+# 检查服务器收到补发的报告后回到手放下的画面（lever_N 显示，手部图片隐藏）
+# 以及浮点数摇杆位置（yuangeki 的初始位置 (L_MAX + R_MAX) / 2、JSON 中的小数）与整数位置分区相同
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from button_printer.services import HIDService, HIDSession, get_lever_calibration
+
+SETTLE_REPORTS = 2  # 与 hid_reader.SETTLE_REPORTS 相同
+
+
+def io4_report(lever, sub_pos):
+    # 没有按键按下：右侧 RW 松开时为 1，system_status 为 0 时算 LW 按下
+    return {'rotary': [sub_pos, lever, 0, 0], 'switches': [0, 1 << 6], 'system_status': 1, 'DEVICE_NAME': 'io4'}
+
+
+def visible_after(session, reports):
+    for data in reports:
+        session.visibility.apply(HIDService.process_structured_hid_data(data, session))
+    return set(session.visibility.snapshot())
+
+
+def is_rest(visible):
+    """手放下：只显示摇杆图片，没有手在摇杆上的图片"""
+    levers = {key for key in visible if key.startswith('lever_')}
+    hands = {key for key in visible if key.startswith(('l_lever_', 'r_lever_'))}
+    return bool(levers) and not hands
+
+
+def check_float_positions():
+    for device_name, position in (('yuangeki', 114.5), ('ontroller', 114.5), ('io4', 1200.5)):
+        lever = get_lever_calibration(device_name)
+        assert lever.zone_key(position) == lever.zone_key(int(position)), (device_name, position)
+        assert lever.sub_position(position) == lever.sub_position(int(position)), (device_name, position)
+    events = HIDService.process_structured_hid_data({'x': 114.5, 'buttons': 0, 'DEVICE_NAME': 'yuangeki'}, HIDSession())
+    assert events, "yuangeki 浮点数位置的报告被丢弃"
+    print("✅ 浮点数摇杆位置")
+
+
+def main():
+    for start, lever in ((20000, -20000), (-20000, 20000), (20000, 0)):
+        session = HIDSession()
+        # 在 start 静止 -> 移动到 lever
+        visible_after(session, [io4_report(start, 0)] * 2)
+        moved = visible_after(session, [io4_report((start + lever) // 2, 100), io4_report(lever, 200)])
+        assert not is_rest(moved), f"摇杆移动中不应显示手放下: {sorted(moved)}"
+        once = visible_after(session, [io4_report(lever, 200)])
+        assert not is_rest(once), f"只补发一次就显示了手放下: {sorted(once)}"
+        settled = visible_after(session, [io4_report(lever, 200)] * (SETTLE_REPORTS - 1))
+        assert is_rest(settled), f"补发 {SETTLE_REPORTS} 次后没有显示手放下: {sorted(settled)}"
+        print(f"lever={lever:>6}  移动中 {sorted(moved)}  停下后 {sorted(settled)}")
+    print("✅ 摇杆停下后恢复手放下")
+    check_float_positions()
+
+
+if __name__ == "__main__":
+    main()